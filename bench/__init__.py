@@ -0,0 +1,10 @@
+# ---------------------------------------------------------------------------
+#  Офлайн-бенчмарки сервера. Нічого не звертається до справжнього OpenAI:
+#    * fake_openai.py – OpenAI-сумісний сервер (chat/completions, embeddings)
+#      з налаштовуваною затримкою та швидкістю генерації токенів;
+#    * stub_mcp.py    – заміна openapi-mcp: stdio MCP-сервер, інструменти якого
+#      викликають dummy_api за OpenAPI-специфікацією;
+#    * load.py        – піднімає все разом і навантажує /chat/stream;
+#    * micro.py       – мікробенчмарки storage та пошуку в RAG;
+#    * __main__.py    – порівняння двох JSON-результатів (python -m bench compare).
+# ---------------------------------------------------------------------------
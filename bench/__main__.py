@@ -0,0 +1,39 @@
+import json
+from pathlib import Path
+
+import typer
+
+from .common import compare as compare_results
+
+# ---------------------------------------------------------------------------
+#  Порівняння двох прогонів одного бенчмарку:
+#    python -m bench compare bench/results/load-A.json bench/results/load-B.json
+#  Друкує кожне числове значення з обох файлів і відносну зміну у відсотках.
+# ---------------------------------------------------------------------------
+
+cli = typer.Typer(help="Офлайн-бенчмарки сервера.")
+
+# Окремий callback, щоб команда викликалася явно: python -m bench compare ...
+@cli.callback()
+def main():
+    pass
+
+@cli.command()
+def compare(
+    old: Path,
+    new: Path,
+    threshold: float = typer.Option(0.0, help="Показувати лише зміни, більші за стільки відсотків."),
+):
+    a = json.loads(old.read_text(encoding="utf-8"))
+    b = json.loads(new.read_text(encoding="utf-8"))
+    if a.get("benchmark") != b.get("benchmark"):
+        typer.echo(f"Different benchmarks: {a.get('benchmark')} vs {b.get('benchmark')}", err=True)
+        raise typer.Exit(code=1)
+    for path, before, after, change in compare_results(a["results"], b["results"]):
+        if change is not None and abs(change) < threshold:
+            continue
+        delta = f"{change:+.1f}%" if change is not None else "n/a"
+        typer.echo(f"{path:<45} {before:>12} {after:>12} {delta:>9}")
+
+if __name__ == "__main__":
+    cli()
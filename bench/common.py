@@ -0,0 +1,159 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterable
+
+import httpx
+
+# ---------------------------------------------------------------------------
+#  Спільні утиліти бенчмарків: ізольована копія коду, перцентилі, запис
+#  результатів у JSON та детерміновані "ембединги" для фейкового OpenAI.
+# ---------------------------------------------------------------------------
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).parent / "results"
+
+# === Ізольований робочий каталог ===============================================
+# chat.db, .faiss_index, .openapi_cache, .rag_cache та .rag_shared сервер створює поруч зі своїми
+# модулями. Щоб бенчмарк не змішав фейкові ембединги зі
+# справжнім індексом і не засмітив історію, запускаємо копію пакетів.
+_IGNORE = shutil.ignore_patterns("__pycache__", ".faiss_index*", ".openapi_cache", ".rag_cache", ".rag_shared", "chat.db*", "profiles")
+
+def workspace() -> Path:
+    path = Path(tempfile.mkdtemp(prefix="mcp-bench-"))
+    for package in ("mcp_server", "dummy_api"):
+        shutil.copytree(ROOT / package, path / package, ignore=_IGNORE)
+    (path / "logs").mkdir()
+    return path
+
+# Обгортка, яку можна вказати в OPENAPI_MCP_BIN: сервер запускає один
+# виконуваний файл, а заглушці потрібен саме цей інтерпретатор Python.
+def stub_mcp_bin(directory: Path, python: str) -> Path:
+    path = directory / "openapi-mcp-stub"
+    path.write_text(f'#!/bin/sh\nexec "{python}" "{Path(__file__).parent / "stub_mcp.py"}" "$@"\n')
+    path.chmod(0o755)
+    return path
+
+# === Процеси ===================================================================
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_http(url: str, timeout: float, proc: subprocess.Popen | None = None) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"process exited with code {proc.returncode} while waiting for {url}")
+        try:
+            if httpx.get(url, timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{url} is not ready after {timeout:.0f}s")
+
+# Пікове RSS процесу (VmHWM) у мегабайтах. Доступно лише в Linux.
+def peak_rss_mb(pid: int) -> float | None:
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+# === Статистика ================================================================
+# Перцентилі методом найближчого рангу, у мілісекундах.
+def percentiles(seconds: Iterable[float]) -> dict[str, float] | None:
+    values = sorted(seconds)
+    if not values:
+        return None
+
+    def rank(p: float) -> float:
+        return values[min(len(values) - 1, max(math.ceil(p / 100 * len(values)) - 1, 0))]
+
+    ms = lambda v: round(v * 1000, 2)
+    return {
+        "count": len(values),
+        "min": ms(values[0]),
+        "p50": ms(rank(50)),
+        "p95": ms(rank(95)),
+        "p99": ms(rank(99)),
+        "max": ms(values[-1]),
+        "mean": ms(sum(values) / len(values)),
+    }
+
+# === Результати ================================================================
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def write_results(name: str, params: dict[str, Any], results: dict[str, Any], output: Path | None = None) -> Path:
+    now = datetime.now(timezone.utc)
+    doc = {
+        "benchmark": name,
+        "timestamp": now.isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"{name}-{now.strftime('%Y%m%d-%H%M%S')}.json"
+    output.write_text(json.dumps(doc, indent=2, ensure_ascii=False), encoding="utf-8")
+    return output
+
+# Порівняння двох результатів одного бенчмарку: усі числові значення з
+# однаковим шляхом і їхня відносна зміна.
+def compare(old: dict, new: dict, prefix: str = "") -> list[tuple[str, float, float, float | None]]:
+    rows = []
+    for key, value in old.items():
+        path = f"{prefix}.{key}" if prefix else str(key)
+        other = new.get(key) if isinstance(new, dict) else None
+        if isinstance(value, dict) and isinstance(other, dict):
+            rows += compare(value, other, path)
+        elif isinstance(value, list) and isinstance(other, list):
+            for i, (a, b) in enumerate(zip(value, other)):
+                if isinstance(a, dict) and isinstance(b, dict):
+                    rows += compare(a, b, f"{path}[{i}]")
+        elif isinstance(value, (int, float)) and isinstance(other, (int, float)) and not isinstance(value, bool):
+            change = (other - value) / value * 100 if value else None
+            rows.append((path, value, other, change))
+    return rows
+
+# === Детерміновані ембединги ===================================================
+# Той самий текст завжди дає той самий нормований вектор; різні тексти – різні.
+# Цього досить, щоб FAISS працював із реалістичною розмірністю.
+EMBEDDING_DIM = 1536
+
+def hash_vector(text: str, dim: int = EMBEDDING_DIM) -> list[float]:
+    raw = b""
+    seed = text.encode("utf-8")
+    counter = 0
+    while len(raw) < dim:
+        raw += hashlib.sha256(seed + counter.to_bytes(4, "little")).digest()
+        counter += 1
+    vector = [b / 127.5 - 1.0 for b in raw[:dim]]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+def encode_base64(vector: list[float]) -> str:
+    return base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass
+
+import typer
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from .common import encode_base64, hash_vector
+
+# ---------------------------------------------------------------------------
+#  Фейковий OpenAI-сумісний сервер для бенчмарків. Підтримує лише те, що
+#  потрібно серверу: /v1/chat/completions (зі стрімінгом і нативними
+#  викликами інструментів) та /v1/embeddings. Відповідь генерується з
+#  налаштовуваною затримкою до першого токена та швидкістю токенів/с, тож
+#  можна моделювати як швидку, так і повільну модель.
+#
+#  Поведінка агента: якщо в запиті є інструменти і після останнього
+#  повідомлення користувача ще не було результату інструмента, "модель"
+#  викликає інструмент Dummy API (за замовчуванням – get_user_info);
+#  інакше повертає текстову відповідь заданої довжини.
+# ---------------------------------------------------------------------------
+
+@dataclass
+class FakeConfig:
+    latency_ms: float = 200.0       # затримка до першого токена
+    tokens_per_sec: float = 100.0   # швидкість генерації
+    output_tokens: int = 60         # довжина текстової відповіді
+    embed_latency_ms: float = 20.0  # затримка одного запиту embeddings
+    tool_calls: bool = True         # чи викликати інструменти
+    tool: str = "get_user_info"     # операція, яку викликаємо (ім'я або початок operationId)
+
+config = FakeConfig()
+
+app = FastAPI(title="Fake OpenAI")
+
+# Значення для обов'язкових параметрів інструмента: рядки-ідентифікатори беремо
+# з dummy_api, решту – за типом зі схеми параметра.
+_SAMPLE_VALUES = {"user": "user123", "item": "item_abc"}
+_SAMPLE_BY_TYPE = {"integer": 10, "number": 1.0, "boolean": True}
+
+def _sample_value(param: str, schema: dict) -> object:
+    # Необов'язкові поля описуються як anyOf: [<тип>, null] – беремо перший не-null.
+    schema = next((s for s in schema.get("anyOf", []) if s.get("type") != "null"), schema)
+    kind = schema.get("type")
+    if kind in _SAMPLE_BY_TYPE:
+        return _SAMPLE_BY_TYPE[kind]
+    if kind == "array":
+        return [_sample_value(param, schema.get("items") or {})]
+    return next((v for k, v in _SAMPLE_VALUES.items() if k in param), "x")
+
+# Ім'я інструмента в openapi-mcp – operationId, наприклад
+# get_user_info_users__user_id__get для config.tool = "get_user_info".
+def _tool_matches(name: str) -> bool:
+    return name == config.tool or name.startswith(config.tool + "_")
+
+def _pick_tool_call(tools: list[dict], messages: list[dict]) -> dict | None:
+    if not config.tool_calls or not tools or not messages or messages[-1].get("role") == "tool":
+        return None
+    for tool in tools:
+        fn = tool.get("function") or {}
+        if _tool_matches(fn.get("name", "")):
+            parameters = fn.get("parameters") or {}
+            properties = parameters.get("properties") or {}
+            required = parameters.get("required") or []
+            args = {p: _sample_value(p, properties.get(p) or {}) for p in required}
+            return {
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {"name": fn["name"], "arguments": json.dumps(args)},
+            }
+    return None
+
+def _answer_words() -> list[str]:
+    return [f"слово{i} " for i in range(config.output_tokens)]
+
+def _usage(messages: list[dict], completion_tokens: int) -> dict:
+    prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+def _chunk(base: dict, delta: dict, finish_reason: str | None = None) -> str:
+    body = {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+    return f"data: {json.dumps(body, ensure_ascii=False)}\n\n"
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.post("/v1/chat/completions")
+async def chat_completions(body: dict):
+    messages = body.get("messages") or []
+    tool_call = _pick_tool_call(body.get("tools") or [], messages)
+    words = [] if tool_call else _answer_words()
+    usage = _usage(messages, 10 if tool_call else len(words))
+    base = {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o-mini"),
+    }
+    delay = 1.0 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+
+    if body.get("stream"):
+        async def stream():
+            await asyncio.sleep(config.latency_ms / 1000)
+            if tool_call:
+                yield _chunk(base, {"role": "assistant", "tool_calls": [{"index": 0, **tool_call}]})
+                yield _chunk(base, {}, "tool_calls")
+            else:
+                yield _chunk(base, {"role": "assistant", "content": ""})
+                for word in words:
+                    yield _chunk(base, {"content": word})
+                    await asyncio.sleep(delay)
+                yield _chunk(base, {}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    await asyncio.sleep(config.latency_ms / 1000 + delay * len(words))
+    message = {"role": "assistant", "content": None if tool_call else "".join(words).strip()}
+    if tool_call:
+        message["tool_calls"] = [tool_call]
+    return {
+        **base,
+        "object": "chat.completion",
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"}],
+        "usage": usage,
+    }
+
+@app.post("/v1/embeddings")
+async def embeddings(body: dict):
+    inputs = body.get("input")
+    # Клієнт може надіслати рядок, список рядків або вже токенізований текст
+    # (списки чисел – так робить langchain_openai).
+    if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+    await asyncio.sleep(config.embed_latency_ms / 1000)
+    as_base64 = body.get("encoding_format") == "base64"
+    data = []
+    for i, text in enumerate(inputs or []):
+        vector = hash_vector(text if isinstance(text, str) else " ".join(map(str, text)))
+        data.append({"object": "embedding", "index": i, "embedding": encode_base64(vector) if as_base64 else vector})
+    return {
+        "object": "list",
+        "data": data,
+        "model": body.get("model", "text-embedding-ada-002"),
+        "usage": {"prompt_tokens": len(data), "total_tokens": len(data)},
+    }
+
+# === CLI =======================================================================
+#   python -m bench.fake_openai --port 9100 --latency-ms 300 --tokens-per-sec 50
+def main(
+    port: int = typer.Option(9100, help="Порт сервера."),
+    latency_ms: float = typer.Option(config.latency_ms, help="Затримка до першого токена, мс."),
+    tokens_per_sec: float = typer.Option(config.tokens_per_sec, help="Швидкість генерації, токенів/с."),
+    output_tokens: int = typer.Option(config.output_tokens, help="Довжина текстової відповіді в токенах."),
+    embed_latency_ms: float = typer.Option(config.embed_latency_ms, help="Затримка запиту embeddings, мс."),
+    tool_calls: bool = typer.Option(config.tool_calls, help="Викликати інструмент перед відповіддю."),
+    tool: str = typer.Option(config.tool, help="Операція для виклику: ім'я або початок operationId."),
+):
+    config.latency_ms, config.tokens_per_sec, config.output_tokens = latency_ms, tokens_per_sec, output_tokens
+    config.embed_latency_ms, config.tool_calls, config.tool = embed_latency_ms, tool_calls, tool
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+if __name__ == "__main__":
+    typer.run(main)
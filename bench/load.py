@@ -0,0 +1,207 @@
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import httpx
+import typer
+
+from .common import (
+    ROOT, free_port, peak_rss_mb, percentiles, stub_mcp_bin, wait_http, workspace, write_results,
+)
+
+# ---------------------------------------------------------------------------
+#  Навантажувальний тест /chat/stream без справжнього OpenAI. Піднімає в
+#  окремих процесах фейковий OpenAI, dummy_api та сам mcp_server (з копії коду
+#  в тимчасовому каталозі, див. common.workspace), чекає на /readyz і
+#  надсилає запити з заданою паралельністю. Частина запитів – прямі пошуки
+#  (швидкий шлях), решта йде через агента, MCP-заглушку та фейкову модель.
+#
+#  Результат: перцентилі часу до першого байта (TTFB) і повного часу
+#  відповіді, запити/с, кількість помилок і 429, пікове RSS процесу сервера та
+#  знімки /scheduler, /mcp/pool, /router, /api-proxy та /coalescing – у JSON у bench/results/.
+#
+#  Запити одного client_id повторюють ті самі повідомлення, тож зі злиттям
+#  однакових запитів (CHAT_COALESCE) одночасні запити підключалися б до чужих
+#  запусків агента, і час відповіді не можна було б порівняти з іншими
+#  прогонами. Тому злиття вимкнене; --coalesce вмикає його, щоб виміряти окремо.
+#
+#    python -m bench.load --requests 200 --concurrency 20 --llm-latency-ms 300
+# ---------------------------------------------------------------------------
+
+_BENCH_KEY = "bench-secret-key"
+
+_FAST_MESSAGES = ["Покажи користувача user123", "item_abc"]
+_AGENT_MESSAGES = [
+    "Які ролі має користувач user123 і що він може робити в системі?",
+    "Розкажи, що відомо про товар item_abc і як його отримати через API.",
+]
+
+@contextmanager
+def _process(cmd: list[str], cwd: Path, env: dict, log: Path) -> Iterator[subprocess.Popen]:
+    with log.open("wb") as out:
+        proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=out, stderr=subprocess.STDOUT)
+        try:
+            yield proc
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+async def _one(client: httpx.AsyncClient, client_id: str, message: str, kind: str) -> dict:
+    started = time.perf_counter()
+    ttfb, status, body = None, None, b""
+    try:
+        async with client.stream(
+            "POST", "/chat/stream",
+            json={"client_id": client_id, "message": message},
+            headers={"X-API-Key": _BENCH_KEY},
+        ) as resp:
+            status = resp.status_code
+            async for chunk in resp.aiter_bytes():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+                body += chunk
+    except httpx.HTTPError as e:
+        return {"kind": kind, "status": None, "ok": False, "error": type(e).__name__}
+    return {
+        "kind": kind,
+        "status": status,
+        "ok": status == 200 and b"event: done" in body,
+        "ttfb": ttfb,
+        "total": time.perf_counter() - started,
+    }
+
+async def _drive(base_url: str, requests: int, concurrency: int, fast_ratio: float, clients: int, timeout: float) -> tuple[list[dict], float]:
+    rng = random.Random(42)
+    plan = []
+    for i in range(requests):
+        fast = rng.random() < fast_ratio
+        message = rng.choice(_FAST_MESSAGES if fast else _AGENT_MESSAGES)
+        plan.append((f"bench-{i % clients}", message, "fast_path" if fast else "agent"))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def run(item):
+            async with semaphore:
+                return await _one(client, *item)
+
+        started = time.perf_counter()
+        samples = await asyncio.gather(*(run(item) for item in plan))
+        return samples, time.perf_counter() - started
+
+def _summary(samples: list[dict], elapsed: float) -> dict:
+    ok = [s for s in samples if s["ok"]]
+    result = {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": sum(1 for s in samples if not s["ok"] and s["status"] != 429),
+        "rejected_429": sum(1 for s in samples if s["status"] == 429),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "ttfb_ms": percentiles(s["ttfb"] for s in ok),
+        "total_ms": percentiles(s["total"] for s in ok),
+    }
+    for kind in ("fast_path", "agent"):
+        of_kind = [s for s in ok if s["kind"] == kind]
+        result[kind] = {
+            "ok": len(of_kind),
+            "ttfb_ms": percentiles(s["ttfb"] for s in of_kind),
+            "total_ms": percentiles(s["total"] for s in of_kind),
+        }
+    return result
+
+def main(
+    requests: int = typer.Option(100, help="Кількість виміряних запитів."),
+    concurrency: int = typer.Option(10, help="Скільки запитів виконується одночасно."),
+    fast_ratio: float = typer.Option(0.3, help="Частка прямих запитів (швидкий шлях)."),
+    clients: int = typer.Option(0, help="Кількість різних client_id (0 – дорівнює concurrency)."),
+    warmup: int = typer.Option(5, help="Запити на прогрів, які не враховуються."),
+    llm_latency_ms: float = typer.Option(200.0, help="Затримка фейкової моделі до першого токена, мс."),
+    tokens_per_sec: float = typer.Option(100.0, help="Швидкість генерації фейкової моделі."),
+    output_tokens: int = typer.Option(60, help="Довжина відповіді фейкової моделі в токенах."),
+    embed_latency_ms: float = typer.Option(20.0, help="Затримка фейкових embeddings, мс."),
+    tool_calls: bool = typer.Option(True, help="Чи викликає фейкова модель MCP-інструмент."),
+    timeout: float = typer.Option(180.0, help="Тайм-аут одного запиту, с."),
+    startup_timeout: float = typer.Option(300.0, help="Скільки чекати на /readyz, с."),
+    output: Path | None = typer.Option(None, help="Файл результатів (за замовчуванням bench/results/)."),
+    keep_workspace: bool = typer.Option(False, help="Не видаляти тимчасовий каталог (логи процесів)."),
+    coalesce: bool = typer.Option(False, help="Увімкнути злиття однакових запитів (CHAT_COALESCE)."),
+):
+    clients = clients or concurrency
+    ws = workspace()
+    fake_port, dummy_port, server_port = free_port(), free_port(), free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(ws), str(ROOT), os.environ.get("PYTHONPATH")])),
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+        "DUMMY_API_URL": f"http://127.0.0.1:{dummy_port}",
+        "DUMMY_API_SECRET_KEY": _BENCH_KEY,
+        "OPENAPI_MCP_BIN": str(stub_mcp_bin(ws, sys.executable)),
+        "CREWAI_DISABLE_TELEMETRY": "true",
+        "OTEL_SDK_DISABLED": "true",
+        "CHAT_COALESCE": "true" if coalesce else "false",
+        "ANSWER_CACHE_ENABLED": "false",
+    }
+    uvicorn = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning"]
+    fake_cmd = [
+        sys.executable, "-m", "bench.fake_openai", "--port", str(fake_port),
+        "--latency-ms", str(llm_latency_ms), "--tokens-per-sec", str(tokens_per_sec),
+        "--output-tokens", str(output_tokens), "--embed-latency-ms", str(embed_latency_ms),
+        "--tool-calls" if tool_calls else "--no-tool-calls",
+    ]
+    params = {
+        "requests": requests, "concurrency": concurrency, "fast_ratio": fast_ratio, "clients": clients,
+        "warmup": warmup, "llm_latency_ms": llm_latency_ms, "tokens_per_sec": tokens_per_sec,
+        "output_tokens": output_tokens, "embed_latency_ms": embed_latency_ms, "tool_calls": tool_calls,
+        "coalesce": coalesce,
+    }
+
+    try:
+        with _process(fake_cmd, ROOT, env, ws / "logs" / "fake_openai.log") as fake, \
+             _process(uvicorn + ["--port", str(dummy_port), "dummy_api.main:app"], ws, env, ws / "logs" / "dummy_api.log") as dummy, \
+             _process(uvicorn + ["--port", str(server_port), "mcp_server.main:app"], ws, env, ws / "logs" / "mcp_server.log") as server:
+            wait_http(f"http://127.0.0.1:{fake_port}/health", 30, fake)
+            wait_http(f"http://127.0.0.1:{dummy_port}/", 30, dummy)
+            started = time.monotonic()
+            wait_http(f"http://127.0.0.1:{server_port}/readyz", startup_timeout, server)
+            ready_s = round(time.monotonic() - started, 2)
+            typer.echo(f"Server ready in {ready_s}s, workspace {ws}")
+
+            base_url = f"http://127.0.0.1:{server_port}"
+            if warmup:
+                asyncio.run(_drive(base_url, warmup, min(warmup, concurrency), fast_ratio, clients, timeout))
+            samples, elapsed = asyncio.run(_drive(base_url, requests, concurrency, fast_ratio, clients, timeout))
+
+            results = _summary(samples, elapsed)
+            results["startup_ready_s"] = ready_s
+            results["server_peak_rss_mb"] = peak_rss_mb(server.pid)
+            for name in ("scheduler", "mcp/pool", "router", "api-proxy", "coalescing"):
+                results[name.replace("/", "_")] = httpx.get(f"{base_url}/{name}", timeout=10).json()
+    finally:
+        if not keep_workspace:
+            shutil.rmtree(ws, ignore_errors=True)
+
+    path = write_results("load", params, results, output)
+    typer.echo(
+        f"ok {results['ok']}/{results['requests']}, errors {results['errors']}, 429 {results['rejected_429']}, "
+        f"{results['rps']} req/s, peak RSS {results['server_peak_rss_mb']} MB"
+    )
+    for metric in ("ttfb_ms", "total_ms"):
+        p = results[metric]
+        if p:
+            typer.echo(f"{metric}: p50 {p['p50']} p95 {p['p95']} p99 {p['p99']}")
+    typer.echo(f"Results written to {path}")
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,201 @@
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import typer
+
+from .common import hash_vector, percentiles, workspace, write_results
+
+# ---------------------------------------------------------------------------
+#  Мікробенчмарки окремих шарів без HTTP:
+#    * storage – history()/messages_after() та add()+flush() на таблиці
+#      messages різного розміру (рядки додаються поступово: 10k, 100k, ...);
+#    * rag     – побудова FAISS-індексу, збереження/завантаження та пошук
+#      (векторний і гібридний) на корпусах різного розміру з детермінованими
+#      ембедингами.
+#  Код сервера імпортується з тимчасової копії (common.workspace), тож
+#  справжні chat.db та .faiss_index не зачіпаються.
+#
+#    python -m bench.micro storage --sizes 10000,100000,1000000
+#    python -m bench.micro rag --sizes 100,1000,10000
+# ---------------------------------------------------------------------------
+
+cli = typer.Typer(help="Мікробенчмарки storage та RAG.")
+
+def _import_server(ws: Path):
+    # config.Settings вимагає ці змінні; справжні значення тут не потрібні.
+    for name, value in {
+        "OPENAI_API_KEY": "sk-bench", "DUMMY_API_URL": "http://127.0.0.1:9",
+        "DUMMY_API_SECRET_KEY": "bench", "OPENAPI_MCP_BIN": "/bin/false",
+    }.items():
+        os.environ.setdefault(name, value)
+    sys.path.insert(0, str(ws))
+    import mcp_server
+    assert Path(mcp_server.__file__).parent == ws / "mcp_server"
+
+def _sizes(value: str) -> list[int]:
+    return sorted(int(v) for v in value.split(",") if v.strip())
+
+# === storage ===================================================================
+def _fill(db: Path, upto: int, clients: int, rng: random.Random) -> None:
+    con = sqlite3.connect(db)
+    have = con.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    rows = (
+        (f"client-{rng.randrange(clients)}", "user" if i % 2 else "assistant", f"повідомлення {i} " * 8)
+        for i in range(have, upto)
+    )
+    with con:
+        con.executemany("INSERT INTO messages(client_id, role, content) VALUES(?,?,?)", rows)
+    con.close()
+
+def bench_storage(sizes: list[int], clients: int, queries: int, writes: int) -> list[dict]:
+    from mcp_server import storage
+
+    # Політика зберігання обрізала б таблицю до HISTORY_MAX_MESSAGES на клієнта.
+    storage.settings.HISTORY_MAX_MESSAGES = 0
+    rng = random.Random(42)
+    results = []
+    for size in sizes:
+        _fill(storage._DB, size, clients, rng)
+        picks = [f"client-{rng.randrange(clients)}" for _ in range(queries)]
+
+        def timed(fn) -> list[float]:
+            out = []
+            for client_id in picks:
+                started = time.perf_counter()
+                fn(client_id)
+                out.append(time.perf_counter() - started)
+            return out
+
+        history = timed(lambda c: storage.history(c, 20))
+        after = timed(lambda c: storage.messages_after(c, 0, 200))
+
+        started = time.perf_counter()
+        for i in range(writes):
+            storage.add(f"client-{i % clients}", "user", f"запис {i}")
+        enqueue = time.perf_counter() - started
+        storage.flush()
+        total = time.perf_counter() - started
+
+        results.append({
+            "rows": size,
+            "history_ms": percentiles(history),
+            "messages_after_ms": percentiles(after),
+            "add_enqueue_per_sec": round(writes / enqueue, 1) if enqueue else None,
+            "add_flush_per_sec": round(writes / total, 1) if total else None,
+        })
+        typer.echo(f"storage {size} rows: history p50 {results[-1]['history_ms']['p50']} ms, "
+                   f"add+flush {results[-1]['add_flush_per_sec']}/s")
+    return results
+
+@cli.command()
+def storage(
+    sizes: str = typer.Option("10000,100000,1000000", help="Розміри таблиці messages через кому."),
+    clients: int = typer.Option(1000, help="Кількість різних client_id."),
+    queries: int = typer.Option(500, help="Кількість читань на кожен розмір."),
+    writes: int = typer.Option(5000, help="Кількість add() на кожен розмір."),
+    output: Path | None = typer.Option(None, help="Файл результатів."),
+):
+    ws = workspace()
+    try:
+        _import_server(ws)
+        results = bench_storage(_sizes(sizes), clients, queries, writes)
+    finally:
+        shutil.rmtree(ws, ignore_errors=True)
+    params = {"sizes": _sizes(sizes), "clients": clients, "queries": queries, "writes": writes}
+    typer.echo(f"Results written to {write_results('micro-storage', params, {'storage': results}, output)}")
+
+# === RAG =======================================================================
+def bench_rag(sizes: list[int], queries: int, k: int, tmp: Path) -> list[dict]:
+    from langchain_core.embeddings import Embeddings
+    from langchain_community.vectorstores import FAISS
+    from mcp_server import rag
+
+    # Ті самі вектори, що й у fake_openai, але без HTTP: вимірюємо сам індекс.
+    class HashEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            return [hash_vector(t) for t in texts]
+
+        def embed_query(self, text):
+            return hash_vector(text)
+
+    emb = HashEmbeddings()
+    rng = random.Random(42)
+    words = [f"термін{i}" for i in range(5000)]
+    results = []
+    for size in sizes:
+        texts = [" ".join(rng.choices(words, k=120)) for _ in range(size)]
+        vectors = emb.embed_documents(texts)
+
+        started = time.perf_counter()
+        store = FAISS.from_embeddings(list(zip(texts, vectors)), emb)
+        build = time.perf_counter() - started
+
+        path = tmp / f"rag-{size}"
+        started = time.perf_counter()
+        store.save_local(str(path))
+        save = time.perf_counter() - started
+        # Завантаження так само, як на сервері: індекс через mmap, docstore з pickle.
+        started = time.perf_counter()
+        rag._read_faiss_index(path, use_mmap=True)
+        rag._read_docstore(path)
+        load = time.perf_counter() - started
+
+        retriever = store.as_retriever(search_kwargs={"k": k})
+        latencies = []
+        for _ in range(queries):
+            query = " ".join(rng.choices(words, k=6))
+            started = time.perf_counter()
+            retriever.invoke(query)
+            latencies.append(time.perf_counter() - started)
+
+        # Гібридний пошук сервера: точні фрази (уривок шматка) обслуговує BM25,
+        # випадкові набори слів ідуть через злиття BM25 + FAISS.
+        started = time.perf_counter()
+        hybrid = rag.HybridRetriever.from_vectorstore(store)
+        lexical_build = time.perf_counter() - started
+        exact, fused = [], []
+        for _ in range(queries):
+            words_of = rng.choice(texts).split()
+            start = rng.randrange(len(words_of) - 3)
+            for query, out in ((" ".join(words_of[start:start + 3]), exact), (" ".join(rng.choices(words, k=6)), fused)):
+                started = time.perf_counter()
+                hybrid.search(query, k)
+                out.append(time.perf_counter() - started)
+
+        results.append({
+            "chunks": size,
+            "build_s": round(build, 4),
+            "save_s": round(save, 4),
+            "load_s": round(load, 4),
+            "query_ms": percentiles(latencies),
+            "lexical_build_s": round(lexical_build, 4),
+            "exact_query_ms": percentiles(exact),
+            "hybrid_query_ms": percentiles(fused),
+        })
+        typer.echo(f"rag {size} chunks: query p50 {results[-1]['query_ms']['p50']} ms, "
+                   f"exact p50 {results[-1]['exact_query_ms']['p50']} ms, load {results[-1]['load_s']} s")
+    return results
+
+@cli.command()
+def rag(
+    sizes: str = typer.Option("100,1000,10000", help="Розміри корпусу (кількість шматків) через кому."),
+    queries: int = typer.Option(200, help="Кількість пошукових запитів на кожен розмір."),
+    k: int = typer.Option(4, help="Скільки шматків повертає пошук."),
+    output: Path | None = typer.Option(None, help="Файл результатів."),
+):
+    ws = workspace()
+    try:
+        _import_server(ws)
+        results = bench_rag(_sizes(sizes), queries, k, ws)
+    finally:
+        shutil.rmtree(ws, ignore_errors=True)
+    params = {"sizes": _sizes(sizes), "queries": queries, "k": k}
+    typer.echo(f"Results written to {write_results('micro-rag', params, {'rag': results}, output)}")
+
+if __name__ == "__main__":
+    cli()
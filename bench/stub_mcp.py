@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import json
+import os
+
+import httpx
+import yaml
+import mcp.types as types
+from mcp.server.lowlevel import Server
+from mcp.server.stdio import stdio_server
+
+# ---------------------------------------------------------------------------
+#  Заглушка openapi-mcp для бенчмарків. Приймає ті самі аргументи
+#  (--base-url <URL> <openapi.yaml>), читає ключ клієнта з env API_KEY і
+#  публікує кожну операцію OpenAPI як MCP-інструмент, що викликає Dummy API
+#  через httpx. Запускається сервером через обгортку з bench/common.py
+#  (stub_mcp_bin), тож не імпортує нічого з цього репозиторію.
+# ---------------------------------------------------------------------------
+
+_HTTP_METHODS = {"get", "post", "put", "patch", "delete"}
+
+def _operations(spec: dict) -> dict[str, dict]:
+    ops = {}
+    for path, item in (spec.get("paths") or {}).items():
+        for method, op in item.items():
+            if method not in _HTTP_METHODS:
+                continue
+            params = [p for p in op.get("parameters", []) if p.get("in") in ("path", "query")]
+            properties = {p["name"]: {"type": (p.get("schema") or {}).get("type", "string")} for p in params}
+            required = [p["name"] for p in params if p.get("required")]
+            if op.get("requestBody"):
+                properties["body"] = {"type": "object"}
+                required.append("body")
+            name = op.get("operationId") or f"{method}_{path}"
+            ops[name] = {
+                "method": method.upper(),
+                "path": path,
+                "path_params": [p["name"] for p in params if p.get("in") == "path"],
+                "tool": types.Tool(
+                    name=name,
+                    description=op.get("summary") or f"{method.upper()} {path}",
+                    inputSchema={"type": "object", "properties": properties, "required": required},
+                ),
+            }
+    return ops
+
+def build_server(base_url: str, spec_path: str) -> Server:
+    with open(spec_path, encoding="utf-8") as f:
+        ops = _operations(yaml.safe_load(f))
+    client = httpx.AsyncClient(base_url=base_url, headers={"X-API-Key": os.environ.get("API_KEY", "")}, timeout=30.0)
+    server = Server("openapi-mcp-stub")
+
+    @server.list_tools()
+    async def list_tools() -> list[types.Tool]:
+        return [op["tool"] for op in ops.values()]
+
+    @server.call_tool()
+    async def call_tool(name: str, arguments: dict) -> list[types.TextContent]:
+        op = ops[name]
+        args = dict(arguments or {})
+        path = op["path"]
+        for param in op["path_params"]:
+            path = path.replace("{" + param + "}", str(args.pop(param, "")))
+        body = args.pop("body", None)
+        resp = await client.request(op["method"], path, params=args, json=body)
+        text = json.dumps({"status": resp.status_code, "body": resp.json() if resp.content else None}, ensure_ascii=False)
+        return [types.TextContent(type="text", text=text)]
+
+    return server
+
+async def _main() -> None:
+    parser = argparse.ArgumentParser(description="openapi-mcp stub for benchmarks")
+    parser.add_argument("--base-url", required=True)
+    parser.add_argument("spec")
+    args = parser.parse_args()
+    server = build_server(args.base_url, args.spec)
+    async with stdio_server() as (read_stream, write_stream):
+        await server.run(read_stream, write_stream, server.create_initialization_options())
+
+if __name__ == "__main__":
+    asyncio.run(_main())
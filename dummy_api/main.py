@@ -1,7 +1,15 @@
-from fastapi import FastAPI, Security, HTTPException, Depends
+from fastapi import FastAPI, Security, HTTPException, Depends, Query, Request
 from fastapi.security.api_key import APIKeyHeader
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
+from typing import Any, Iterable
+import base64
+import binascii
+import bisect
+import json
 import os
+import random
+import secrets
 
 # ---------------------------------------------------------------------------
 #  Цей модуль демонструє створення невеликого REST API за допомогою FastAPI.
@@ -9,6 +17,13 @@ import os
 #  простим механізмом авторизації "ключ в заголовку". Коментарі розписані
 #  максимально докладно, аби програмісти, що ніколи не працювали з FastAPI,
 #  зрозуміли кожен крок.
+#
+#  Дані завантажуються один раз під час старту в індексовані структури
+#  (Dataset): словник за ідентифікатором для точкових запитів і відсортований
+#  список ідентифікаторів для посторінкового перегляду. Крім запитів однієї
+#  сутності API вміє віддавати багато сутностей за один виклик
+#  (GET /users?ids=..., POST /items:batchGet) – агенту, якому потрібні 50
+#  користувачів, достатньо одного виклику інструмента замість 50.
 # ---------------------------------------------------------------------------
 
 # === Налаштування авторизації =================================================
@@ -21,6 +36,97 @@ API_KEY_NAME = "X-API-Key"
 #     згенерована помилка 403. Ми могли б поставити False і обробити її самостійно.
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=True)
 
+# === Набір даних ===============================================================
+# Початкові записи, які завжди є в API (на них посилаються приклади та
+# документація RAG).
+SEED_USERS = [
+    {"user_id": "user123", "username": "Alice", "roles": ["admin", "user"]},
+    {"user_id": "user456", "username": "Bob", "roles": ["user"]},
+]
+SEED_ITEMS = [
+    {"item_id": "item_abc", "name": "Laptop", "description": "A powerful machine"},
+    {"item_id": "item_def", "name": "Mouse", "description": "An ergonomic mouse"},
+]
+
+# Індексовані колекції: by_id – пошук за O(1), ids – відсортовані
+# ідентифікатори, по яких бінарним пошуком знаходимо початок сторінки.
+class Collection:
+    def __init__(self, key: str, records: Iterable[dict]):
+        self.key = key
+        self.by_id = {r[key]: r for r in records}
+        self.ids = sorted(self.by_id)
+        self.fields = sorted({f for r in self.by_id.values() for f in r})
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    # Сторінка після ідентифікатора after (None – з початку).
+    def page(self, after: str | None, limit: int) -> tuple[list[dict], str | None]:
+        start = bisect.bisect_right(self.ids, after) if after is not None else 0
+        ids = self.ids[start:start + limit]
+        last = ids[-1] if ids and start + limit < len(self.ids) else None
+        return [self.by_id[i] for i in ids], last
+
+    # Пакетне читання: знайдені записи в порядку запиту та відсутні ідентифікатори.
+    def many(self, ids: list[str]) -> tuple[list[dict], list[str]]:
+        found, missing = [], []
+        for i in dict.fromkeys(ids):
+            record = self.by_id.get(i)
+            if record is None:
+                missing.append(i)
+            else:
+                found.append(record)
+        return found, missing
+
+class Dataset:
+    def __init__(self, users: Iterable[dict], items: Iterable[dict]):
+        self.users = Collection("user_id", users)
+        self.items = Collection("item_id", items)
+
+# Згенеровані записи для навантажувальних тестів: детерміновані, тож у
+# кожного процесу однаковий набір даних.
+_NAMES = ["Olena", "Taras", "Iryna", "Mykola", "Sofia", "Andrii", "Oksana", "Petro"]
+_ROLES = ["user", "editor", "admin", "viewer"]
+_PRODUCTS = ["Keyboard", "Monitor", "Headset", "Webcam", "Dock", "Charger", "Tablet", "Speaker"]
+
+def generate(users: int, items: int, seed: int = 42) -> tuple[list[dict], list[dict]]:
+    rng = random.Random(seed)
+    gen_users = [
+        {"user_id": f"user_{i:06d}", "username": f"{rng.choice(_NAMES)} {i}",
+         "roles": sorted(set(rng.choices(_ROLES, k=rng.randint(1, 2))))}
+        for i in range(users)
+    ]
+    gen_items = [
+        {"item_id": f"item_{i:06d}", "name": f"{rng.choice(_PRODUCTS)} {i}",
+         "description": f"Generated product #{i}"}
+        for i in range(items)
+    ]
+    return gen_users, gen_items
+
+# Джерела даних (змінні середовища читаються один раз під час старту):
+#   DUMMY_API_DATA=path.json          – {"users": [...], "items": [...]} замість початкових записів;
+#   DUMMY_API_GENERATE_USERS/ITEMS=N  – додати N згенерованих записів.
+def load_dataset() -> Dataset:
+    users, items = list(SEED_USERS), list(SEED_ITEMS)
+    path = os.getenv("DUMMY_API_DATA")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        users, items = data.get("users", []), data.get("items", [])
+    gen_users, gen_items = generate(
+        int(os.getenv("DUMMY_API_GENERATE_USERS", "0")), int(os.getenv("DUMMY_API_GENERATE_ITEMS", "0"))
+    )
+    return Dataset(users + gen_users, items + gen_items)
+
+# === Життєвий цикл застосунку ==================================================
+# Дані та еталонний ключ готуються один раз під час старту і зберігаються в
+# app.state – обробники запитів лише читають готові структури.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.data = load_dataset()
+    app.state.api_key = os.getenv("DUMMY_API_SECRET_KEY", "")
+    yield
+
 # === Ініціалізація FastAPI =====================================================
 # FastAPI створює об'єкт застосунку, який приймає вхідні HTTP‑запити і
 # повертає відповіді. Аргументи title/description/version потрапляють у
@@ -29,6 +135,7 @@ app = FastAPI(
     title="Dummy Product API",
     description="Фіктивний API з авторизацією X-API-Key. Перевірте /openapi.json та /docs.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # === Моделі даних ==============================================================
@@ -45,14 +152,27 @@ class Item(BaseModel):
     name: str
     description: str | None = None
 
+# Відповідь списку чи пакетного читання. Записи – словники, бо з параметром
+# fields у них лише вибрані поля.
+class Page(BaseModel):
+    data: list[dict[str, Any]]
+    next_cursor: str | None = Field(None, description="Передайте в cursor, щоб отримати наступну сторінку.")
+    missing: list[str] = Field(default_factory=list, description="Ідентифікатори, яких немає в базі.")
+
+class BatchGetRequest(BaseModel):
+    ids: list[str] = Field(..., max_length=100, description="До 100 ідентифікаторів товарів.")
+    fields: list[str] | None = Field(None, description="Які поля повернути (за замовчуванням усі).")
+
 # === Функція перевірки ключа ===================================================
 # Security(...) запускає заздалегідь сконфігурований APIKeyHeader, дістає
 # значення ключа із заголовка запиту та передає його у параметр api_key.
-# Ми порівнюємо його з еталонним значенням із змінної середовища.
-async def get_api_key(api_key: str = Security(api_key_header)):
-    expected = os.getenv("DUMMY_API_SECRET_KEY", "")
-    # Якщо ключ співпадає – повертаємо його, інакше повідомляємо про помилку
-    if api_key and api_key == expected:
+# Ми порівнюємо його з еталонним значенням, прочитаним зі змінної середовища
+# DUMMY_API_SECRET_KEY під час старту.
+async def get_api_key(request: Request, api_key: str = Security(api_key_header)):
+    expected = request.app.state.api_key
+    # Якщо ключ співпадає – повертаємо його, інакше повідомляємо про помилку.
+    # compare_digest порівнює за сталий час, не підказуючи, скільки символів збіглося.
+    if api_key and expected and secrets.compare_digest(api_key, expected):
         return api_key
     raise HTTPException(status_code=403, detail="Could not validate credentials")
 
@@ -67,27 +187,92 @@ def root():
 # повідомляє FastAPI, що відповідь має відповідати схемі UserInfo.
 # Параметр tags додає ендпоїнт у відповідну групу в Swagger UI.
 @app.get("/users/{user_id}", response_model=UserInfo, tags=["Users"])
-async def get_user_info(user_id: str, api_key: str = Depends(get_api_key)):
-    # "База даних" користувачів – звичайний словник для прикладу
-    users_db = {
-        "user123": {"user_id": "user123", "username": "Alice", "roles": ["admin", "user"]},
-        "user456": {"user_id": "user456", "username": "Bob", "roles": ["user"]},
-    }
-    if user_id in users_db:
-        return users_db[user_id]
+async def get_user_info(user_id: str, request: Request, api_key: str = Depends(get_api_key)):
+    user = request.app.state.data.users.by_id.get(user_id)
+    if user is not None:
+        return user
     raise HTTPException(status_code=404, detail="User not found")
 
 # === Ендпоїнт /items/{item_id} ==================================================
 @app.get("/items/{item_id}", response_model=Item, tags=["Items"])
-async def get_item_info(item_id: str, api_key: str = Depends(get_api_key)):
-    items_db = {
-        "item_abc": {"item_id": "item_abc", "name": "Laptop", "description": "A powerful machine"},
-        "item_def": {"item_id": "item_def", "name": "Mouse", "description": "An ergonomic mouse"},
-    }
-    if item_id in items_db:
-        return items_db[item_id]
+async def get_item_info(item_id: str, request: Request, api_key: str = Depends(get_api_key)):
+    item = request.app.state.data.items.by_id.get(item_id)
+    if item is not None:
+        return item
     raise HTTPException(status_code=404, detail="Item not found")
 
+# === Списки та пакетне читання =================================================
+# Курсор – закодований ідентифікатор останнього запису сторінки. На відміну
+# від offset, він не "з'їжджає", якщо між запитами додалися нові записи.
+MAX_LIMIT = 500
+MAX_BATCH = 100
+
+def _encode_cursor(last_id: str | None) -> str | None:
+    return base64.urlsafe_b64encode(last_id.encode("utf-8")).decode("ascii") if last_id is not None else None
+
+def _decode_cursor(cursor: str | None) -> str | None:
+    if not cursor:
+        return None
+    try:
+        return base64.b64decode(cursor.encode("ascii"), altchars=b"-_", validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _split(value: str | None) -> list[str] | None:
+    return [v.strip() for v in value.split(",") if v.strip()] if value else None
+
+# Вибір полів: ідентифікатор повертається завжди, щоб записи можна було зіставити.
+def _select(collection: Collection, records: list[dict], fields: list[str] | None) -> list[dict]:
+    if not fields:
+        return records
+    unknown = set(fields) - set(collection.fields)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    keep = [collection.key] + [f for f in fields if f != collection.key]
+    return [{f: r.get(f) for f in keep} for r in records]
+
+def _list_or_batch(collection: Collection, ids: str | None, cursor: str | None, limit: int, fields: str | None) -> Page:
+    wanted = _split(ids)
+    if wanted is not None:
+        if len(wanted) > MAX_BATCH:
+            raise HTTPException(status_code=422, detail=f"At most {MAX_BATCH} ids per request")
+        found, missing = collection.many(wanted)
+        return Page(data=_select(collection, found, _split(fields)), missing=missing)
+    records, last = collection.page(_decode_cursor(cursor), limit)
+    return Page(data=_select(collection, records, _split(fields)), next_cursor=_encode_cursor(last))
+
+@app.get("/users", response_model=Page, tags=["Users"])
+async def list_users(
+    request: Request,
+    ids: str | None = Query(None, description="Ідентифікатори через кому – пакетне читання до 100 користувачів."),
+    cursor: str | None = Query(None, description="next_cursor з попередньої сторінки."),
+    limit: int = Query(50, ge=1, le=MAX_LIMIT, description="Розмір сторінки."),
+    fields: str | None = Query(None, description="Поля через кому, напр. user_id,username."),
+    api_key: str = Depends(get_api_key),
+):
+    """Кілька користувачів за ids або посторінковий список усіх користувачів."""
+    return _list_or_batch(request.app.state.data.users, ids, cursor, limit, fields)
+
+@app.get("/items", response_model=Page, tags=["Items"])
+async def list_items(
+    request: Request,
+    cursor: str | None = Query(None, description="next_cursor з попередньої сторінки."),
+    limit: int = Query(50, ge=1, le=MAX_LIMIT, description="Розмір сторінки."),
+    fields: str | None = Query(None, description="Поля через кому, напр. item_id,name."),
+    api_key: str = Depends(get_api_key),
+):
+    """Посторінковий список товарів."""
+    return _list_or_batch(request.app.state.data.items, None, cursor, limit, fields)
+
+# POST, бо список ідентифікаторів може не вміститися в URL. Двокрапка в шляху –
+# звична для пакетних методів форма "ресурс:дія".
+@app.post("/items:batchGet", response_model=Page, tags=["Items"])
+async def batch_get_items(body: BatchGetRequest, request: Request, api_key: str = Depends(get_api_key)):
+    """Кілька товарів за один виклик: знайдені записи та список відсутніх ids."""
+    collection = request.app.state.data.items
+    found, missing = collection.many(body.ids)
+    return Page(data=_select(collection, found, body.fields), missing=missing)
+
 # === Точка входу ===============================================================
 # Якщо цей файл запускати безпосередньо (python main.py),
 # ми піднімаємо веб-сервер Uvicorn. dotenv.load_dotenv() читає файл .env і
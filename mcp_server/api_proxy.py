@@ -0,0 +1,273 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import socket
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+from . import metrics
+from .config import settings
+
+# ---------------------------------------------------------------------------
+#  Локальний кешувальний reverse proxy перед Dummy API. Процеси openapi-mcp
+#  отримують --base-url цього проксі замість DUMMY_API_URL, і кожен виклик
+#  інструмента (GET /users/{user_id}, /items/{item_id}) проходить через нього:
+#    * кеш розділений за API-ключем клієнта: ключ кешу містить хеш ключа, тож
+#      відповідь, отриману з одним ключем, ніколи не буде віддано з іншим;
+#    * однакові одночасні GET-запити (той самий ключ і URL) зливаються в один
+#      запит до Dummy API – решта чекають на його результат (single-flight);
+#    * до Dummy API ходить один httpx.AsyncClient з пулом keep-alive з'єднань;
+#    * строк життя відповіді – з Cache-Control (max-age, no-store, no-cache),
+#      або API_PROXY_DEFAULT_TTL, якщо заголовка немає;
+#    * частка влучань і час відповіді Dummy API видно в /api-proxy та /metrics.
+#  Проксі слухає 127.0.0.1 на окремому порту (API_PROXY_PORT, 0 – вільний) і
+#  працює в тому самому циклі подій, що й сервер, тож швидкий маршрутизатор
+#  викликає fetch() напряму, без зайвого HTTP-стрибка.
+# ---------------------------------------------------------------------------
+
+# Кешуємо лише успішні відповіді та 404 (сутності немає – це теж відповідь).
+_CACHEABLE_STATUS = {200, 404}
+# Заголовки, які передаємо в обидва боки. Решта (Host, Connection тощо)
+# стосується конкретного з'єднання.
+_REQUEST_HEADERS = ("x-api-key", "accept", "content-type")
+_RESPONSE_HEADERS = ("content-type", "cache-control", "etag", "last-modified")
+
+_MAX_AGE_RE = re.compile(r"(?:^|,)\s*max-age\s*=\s*(\d+)", re.IGNORECASE)
+
+@dataclass
+class ProxyResponse:
+    status_code: int
+    headers: dict[str, str]
+    content: bytes
+    stored_at: float = field(default_factory=time.time)
+    expires_at: float = 0.0
+
+    def json(self):
+        return json.loads(self.content)
+
+# Скільки секунд можна віддавати відповідь з кешу (0 – не кешувати).
+def _ttl(cache_control: str | None) -> float:
+    if cache_control is None:
+        return settings.API_PROXY_DEFAULT_TTL
+    directives = cache_control.lower()
+    if "no-store" in directives or "no-cache" in directives:
+        return 0.0
+    m = _MAX_AGE_RE.search(directives)
+    return float(m.group(1)) if m else settings.API_PROXY_DEFAULT_TTL
+
+def _partition(api_key: str | None) -> str:
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+class CachingProxy:
+    def __init__(self, upstream: str, max_entries: int, max_connections: int):
+        self._upstream = upstream
+        self._max_entries = max_entries
+        self._max_connections = max_connections
+        self._client: httpx.AsyncClient | None = None
+        self._cache: OrderedDict[tuple[str, str], ProxyResponse] = OrderedDict()
+        self._inflight: dict[tuple[str, str], asyncio.Future] = {}
+        self._stats = {
+            "requests": 0, "hits": 0, "misses": 0, "coalesced": 0, "bypassed": 0,
+            "upstream_requests": 0, "upstream_errors": 0, "upstream_seconds": 0.0,
+        }
+
+    def _http(self) -> httpx.AsyncClient:
+        # Один клієнт на процес: з'єднання з Dummy API лишаються відкритими між запитами.
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self._upstream,
+                timeout=10.0,
+                limits=httpx.Limits(
+                    max_connections=self._max_connections,
+                    max_keepalive_connections=self._max_connections,
+                    keepalive_expiry=60.0,
+                ),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _upstream_call(self, method: str, url: str, headers: dict[str, str], body: bytes | None) -> ProxyResponse:
+        self._stats["upstream_requests"] += 1
+        started = time.perf_counter()
+        try:
+            resp = await self._http().request(method, url, headers=headers, content=body)
+        except httpx.HTTPError:
+            self._stats["upstream_errors"] += 1
+            metrics.stage_errors.inc("dummy_api")
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stats["upstream_seconds"] += elapsed
+            metrics.observe("dummy_api", elapsed)
+        kept = {k: v for k, v in resp.headers.items() if k.lower() in _RESPONSE_HEADERS}
+        return ProxyResponse(resp.status_code, kept, resp.content)
+
+    def _lookup(self, key: tuple[str, str]) -> ProxyResponse | None:
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        if cached.expires_at < time.time():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return cached
+
+    def _store(self, key: tuple[str, str], resp: ProxyResponse) -> None:
+        ttl = _ttl(resp.headers.get("cache-control"))
+        if resp.status_code not in _CACHEABLE_STATUS or ttl <= 0 or self._max_entries <= 0:
+            return
+        resp.expires_at = resp.stored_at + ttl
+        self._cache[key] = resp
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._max_entries:
+            self._cache.popitem(last=False)
+
+    # Повертає (відповідь, "HIT" | "COALESCED" | "MISS" | "BYPASS"). url – шлях разом із query.
+    async def fetch(
+        self,
+        method: str,
+        url: str,
+        api_key: str | None,
+        headers: dict[str, str] | None = None,
+        body: bytes | None = None,
+        refresh: bool = False,
+    ) -> tuple[ProxyResponse, str]:
+        self._stats["requests"] += 1
+        headers = dict(headers or {})
+        if api_key is not None:
+            headers["X-API-Key"] = api_key
+        if method != "GET":
+            self._stats["bypassed"] += 1
+            return await self._upstream_call(method, url, headers, body), "BYPASS"
+
+        key = (_partition(api_key), url)
+        cached = None if refresh else self._lookup(key)
+        if cached is not None:
+            self._stats["hits"] += 1
+            return cached, "HIT"
+
+        # Такий самий запит уже летить до Dummy API – чекаємо на його відповідь.
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self._stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(pending), "COALESCED"
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+            # Запит, на який ми чекали, скасовано (клієнт пішов) – робимо свій.
+            return await self.fetch(method, url, api_key, headers, body, refresh)
+
+        self._stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            resp = await self._upstream_call(method, url, headers, body)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # позначаємо як отриману, якщо ніхто не чекав
+            raise
+        else:
+            self._store(key, resp)
+            future.set_result(resp)
+            return resp, "MISS"
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        served = self._stats["hits"] + self._stats["coalesced"] + self._stats["misses"]
+        upstream = self._stats["upstream_requests"]
+        return {
+            **self._stats,
+            "entries": len(self._cache),
+            "hit_ratio": (self._stats["hits"] + self._stats["coalesced"]) / served if served else 0.0,
+            "upstream_avg_ms": self._stats["upstream_seconds"] / upstream * 1000 if upstream else 0.0,
+        }
+
+proxy = CachingProxy(settings.DUMMY_API_URL, settings.API_PROXY_CACHE_SIZE, settings.API_PROXY_MAX_CONNECTIONS)
+
+# === HTTP-фасад для openapi-mcp ================================================
+# Без /docs та /openapi.json: усі шляхи мають вести до Dummy API.
+app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None)
+
+@app.api_route("/{path:path}", methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE"])
+async def forward(path: str, request: Request):
+    url = "/" + path + (f"?{request.url.query}" if request.url.query else "")
+    headers = {k: v for k, v in request.headers.items() if k.lower() in _REQUEST_HEADERS and k.lower() != "x-api-key"}
+    method = "GET" if request.method == "HEAD" else request.method
+    body = await request.body() if method != "GET" else None
+    refresh = "no-cache" in (request.headers.get("cache-control") or "").lower()
+    try:
+        resp, status = await proxy.fetch(method, url, request.headers.get("x-api-key"), headers, body, refresh)
+    except httpx.HTTPError as e:
+        logging.warning(f"Dummy API request {method} {url} failed: {e}")
+        return Response(status_code=502, content=b'{"detail":"Upstream request failed"}', media_type="application/json")
+    out_headers = dict(resp.headers)
+    out_headers["X-Cache"] = status
+    out_headers["Age"] = str(int(time.time() - resp.stored_at))
+    if request.method == "HEAD":
+        # HEAD відповідаємо з кешу GET, але без тіла: лише заголовки й довжина.
+        out_headers["Content-Length"] = str(len(resp.content))
+        return Response(status_code=resp.status_code, headers=out_headers)
+    return Response(status_code=resp.status_code, content=resp.content, headers=out_headers)
+
+# === Запуск поруч із сервером ==================================================
+# Сигнали зупинки обробляє основний uvicorn; вбудований сервер лише
+# завершується разом з ним (з lifespan у main.py).
+class _EmbeddedServer(uvicorn.Server):
+    @contextmanager
+    def capture_signals(self):
+        yield
+
+_server: _EmbeddedServer | None = None
+_base_url: str | None = None
+
+# Адреса для --base-url процесів openapi-mcp: проксі, якщо він запущений,
+# інакше сам Dummy API.
+def base_url() -> str:
+    return _base_url or settings.DUMMY_API_URL
+
+# Якщо порт зайнятий, проксі не запускається: інструменти працюють напряму з
+# Dummy API (base_url() поверне DUMMY_API_URL), а сервер стартує як зазвичай.
+async def serve() -> None:
+    global _server, _base_url
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind(("127.0.0.1", settings.API_PROXY_PORT))
+    except OSError as e:
+        sock.close()
+        logging.error(f"Dummy API caching proxy disabled: cannot bind port {settings.API_PROXY_PORT}: {e}")
+        return
+    # Черга з'єднань існує вже зараз: openapi-mcp може під'єднатися ще до того,
+    # як uvicorn почне приймати запити.
+    sock.listen(128)
+    host, port = sock.getsockname()
+    _server = _EmbeddedServer(uvicorn.Config(app, log_level="warning", access_log=False, lifespan="off"))
+    _base_url = f"http://{host}:{port}"
+    logging.info(f"Dummy API caching proxy listening on {_base_url}")
+    try:
+        await _server.serve(sockets=[sock])
+    finally:
+        _base_url = None
+        sock.close()
+
+async def shutdown() -> None:
+    if _server is not None:
+        _server.should_exit = True
+    await proxy.aclose()
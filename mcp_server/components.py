@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable, Generic, TypeVar
+
+# ---------------------------------------------------------------------------
+#  Ліниві компоненти сервера. Важкі речі – імпорт CrewAI, побудова
+#  RAG-індексу, LLM-клієнт, OpenAPI-специфікація – більше не створюються під
+#  час імпорту модулів. Кожна з них загорнута в LazyComponent: об'єкт
+#  створюється під час першого get() (або фонового прогріву після старту), а
+#  статус ініціалізації видно в /readyz. Завдяки цьому uvicorn відкриває порт
+#  за мілісекунди, а недоступний OpenAI не валить процес, а лише робить
+#  сервер "не готовим", доки компонент не вдасться ініціалізувати.
+# ---------------------------------------------------------------------------
+
+T = TypeVar("T")
+
+# Усі створені компоненти в порядку реєстрації – для /readyz та прогріву.
+_registry: dict[str, "LazyComponent"] = {}
+
+class LazyComponent(Generic[T]):
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value: T | None = None
+        self.status = "pending"        # pending | initializing | ready | error
+        self.error: str | None = None
+        self.init_seconds: float | None = None
+        _registry[name] = self
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def get(self) -> T:
+        """Повертає об'єкт, створюючи його під час першого виклику."""
+        if self.status == "ready":
+            return self._value
+        # Лише один потік виконує factory; решта чекають на блокуванні й
+        # отримують уже готовий об'єкт. Після помилки наступний get() пробує знову.
+        with self._lock:
+            if self.status == "ready":
+                return self._value
+            self.status = "initializing"
+            started = time.monotonic()
+            try:
+                value = self._factory()
+            except Exception as e:
+                self.status = "error"
+                self.error = f"{type(e).__name__}: {e}"
+                raise
+            self._value = value
+            self.init_seconds = time.monotonic() - started
+            self.error = None
+            self.status = "ready"
+            logging.info(f"Component {self.name} ready in {self.init_seconds * 1000:.0f} ms")
+            return value
+
+    def describe(self) -> dict:
+        info = {"status": self.status}
+        if self.init_seconds is not None:
+            info["init_ms"] = round(self.init_seconds * 1000, 1)
+        if self.error:
+            info["error"] = self.error
+        return info
+
+def readiness() -> dict[str, dict]:
+    return {name: component.describe() for name, component in _registry.items()}
+
+def all_ready() -> bool:
+    return all(component.ready for component in _registry.values())
+
+# === Фоновий прогрів ===========================================================
+# Ініціалізує всі зареєстровані компоненти паралельно у робочих потоках.
+# Компоненти, що впали, пробуємо знову з експоненційною затримкою, доки всі
+# не стануть готовими. Нові компоненти можуть з'явитися під час прогріву
+# (наприклад, після імпорту crew_runtime), тому список перечитується щоразу.
+async def warm_up(max_delay: float = 60.0) -> None:
+    delay = 1.0
+    while True:
+        pending = [c for c in _registry.values() if not c.ready]
+        if not pending:
+            return
+        results = await asyncio.gather(*(asyncio.to_thread(c.get) for c in pending), return_exceptions=True)
+        failed = [c.name for c, r in zip(pending, results) if isinstance(r, Exception)]
+        if failed:
+            logging.warning(f"Warm-up failed for {', '.join(failed)}; retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
@@ -17,5 +17,94 @@ class Settings(BaseSettings):
     DUMMY_API_SECRET_KEY: str
     OPENAPI_MCP_BIN: str  # шлях до бинарника
 
+    # Необов'язкова адреса OpenAI-сумісного API (наприклад, фейковий сервер
+    # бенчмарків із bench/fake_openai.py). Порожнє значення – справжній OpenAI.
+    OPENAI_BASE_URL: str | None = None
+
+    # Пул MCP-сесій: скільки процесів openapi-mcp тримати одночасно, через
+    # скільки секунд простою закривати сесію та скільки чекати на вільну.
+    MCP_POOL_MAX_SIZE: int = 8
+    MCP_POOL_IDLE_TTL: float = 300.0
+    MCP_POOL_ACQUIRE_TIMEOUT: float = 30.0
+
+    # Скільки останніх повідомлень зберігати для одного клієнта (0 – без обмежень).
+    HISTORY_MAX_MESSAGES: int = 1000
+    # Як часто (у секундах) фоновий записувач ущільнює базу: переносить WAL в
+    # основний файл і оновлює статистику запитів (0 – не ущільнювати).
+    HISTORY_COMPACT_INTERVAL: float = 3600.0
+
+    # Планувальник запусків агента: кількість робочих потоків, ліміт
+    # одночасних запитів одного клієнта, розмір черги очікування та дедлайн
+    # одного запуску в секундах.
+    AGENT_WORKERS: int = 4
+    AGENT_MAX_PER_CLIENT: int = 2
+    AGENT_QUEUE_SIZE: int = 16
+    AGENT_RUN_DEADLINE: float = 120.0
+
+    # Бюджет контексту розмови в токенах: скільки займають останні
+    # повідомлення дослівно та скільки – накопичувальний підсумок старіших.
+    HISTORY_TOKEN_BUDGET: int = 2000
+    SUMMARY_TOKEN_BUDGET: int = 400
+
+    # Швидкий маршрутизатор: прямі запити однієї сутності (user123, item_abc)
+    # обробляються без агента. ROUTER_MAX_WORDS – максимальна довжина такого запиту.
+    ROUTER_ENABLED: bool = True
+    ROUTER_MAX_WORDS: int = 8
+
+    # Як часто (у секундах) перевіряти, чи не змінилася OpenAPI-специфікація
+    # Dummy API (0 – не перевіряти, використовувати перший завантажений знімок).
+    OPENAPI_REFRESH_INTERVAL: float = 300.0
+
+    # Пошук у базі знань: скільки шматків повертати за замовчуванням, скільки
+    # кандидатів брати з BM25 та FAISS перед злиттям (і максимум для k) та
+    # константа reciprocal rank fusion.
+    RAG_TOP_K: int = 4
+    RAG_CANDIDATES: int = 20
+    RAG_RRF_K: int = 60
+
+    # Кеш пошуку: скільки ембедингів запитів і результатів тримати (0 – вимкнено),
+    # скільки секунд вони живуть, з якої косинусної близькості вектор запиту
+    # вважається "тим самим" (1 – лише точний збіг тексту) і чи зберігати кеш на диск.
+    RAG_CACHE_SIZE: int = 1024
+    RAG_CACHE_TTL: float = 3600.0
+    RAG_CACHE_SIMILARITY: float = 0.98
+    RAG_CACHE_PERSIST: bool = False
+
+    # Режим кількох робочих процесів (uvicorn --workers N): індекс будує окремий
+    # процес `python -m mcp_server.rag publish --watch 30`, а сервер лише
+    # відкриває опубліковане покоління через mmap і раз на RAG_RELOAD_INTERVAL
+    # секунд перевіряє, чи не з'явилося нове (0 – не перевіряти).
+    RAG_SHARED_INDEX: bool = False
+    RAG_RELOAD_INTERVAL: float = 5.0
+
+    # Кешувальний проксі перед Dummy API для інструментів MCP і швидкого шляху:
+    # порт на 127.0.0.1 (0 – будь-який вільний), скільки відповідей тримати,
+    # строк життя відповіді без Cache-Control (секунди) та розмір пулу з'єднань.
+    # API_PROXY_ENABLED=false – openapi-mcp ходить до Dummy API напряму.
+    API_PROXY_ENABLED: bool = True
+    API_PROXY_PORT: int = 0
+    API_PROXY_CACHE_SIZE: int = 2048
+    API_PROXY_DEFAULT_TTL: float = 30.0
+    API_PROXY_MAX_CONNECTIONS: int = 32
+
+    # Однаковий запит (той самий client_id, API-ключ і текст), що надійшов, поки
+    # агент ще відповідає на перший, підключається до вже запущеного агента.
+    CHAT_COALESCE: bool = True
+
+    # Кеш відповідей агента (вимкнено за замовчуванням): лише для ходів без
+    # інструментів MCP та історії розмови. Скільки відповідей тримати, скільки
+    # секунд вони живуть і з якої косинусної близькості ембедингів питання
+    # вважається тим самим (1 – лише точний збіг тексту).
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_SIZE: int = 256
+    ANSWER_CACHE_TTL: float = 600.0
+    ANSWER_CACHE_SIMILARITY: float = 0.95
+
+    # Семплінговий профайлер (потрібен pyinstrument): частка запусків агента,
+    # які профілюються (0 – вимкнено), і поріг у мс, після якого звіт
+    # зберігається в mcp_server/profiles/.
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_SLOW_MS: float = 5000.0
+
 # Ініціалізуємо глобальний об'єкт settings, який можна імпортувати з інших модулів.
 settings = Settings()
@@ -0,0 +1,139 @@
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Tuple
+
+from . import metrics, storage
+from .config import settings
+
+# ---------------------------------------------------------------------------
+#  Побудова контексту розмови з обмеженням за токенами. Раніше в промпт
+#  потрапляли останні 20 повідомлень дослівно, тож довгі відповіді асистента
+#  роздували кожен наступний запит до LLM. Тепер:
+#    * останні повідомлення беруться дослівно, поки вміщуються в
+#      HISTORY_TOKEN_BUDGET;
+#    * усе старіше згортається в накопичувальний підсумок (не більше
+#      SUMMARY_TOKEN_BUDGET токенів), який зберігається в storage поруч з
+#      історією і оновлюється інкрементально – до нього дописуються лише ті
+#      повідомлення, що щойно випали з бюджету.
+#  Отже розмір промпта приблизно сталий, хоч би якою довгою була розмова.
+# ---------------------------------------------------------------------------
+
+# Службові токени на одне повідомлення (роль, розділювачі) – наближено, як у
+# рекомендаціях OpenAI для chat-формату.
+_PER_MESSAGE_TOKENS = 4
+
+# Скільки останніх повідомлень максимально читаємо з бази за один раз. Старіші
+# непідсумовані повідомлення (якщо їх більше) згортаються в підсумок сторінками
+# такого самого розміру – див. _fold_backlog.
+_MAX_MESSAGES = 200
+
+@dataclass
+class ConversationContext:
+    summary: str
+    turns: list[Tuple[str, str]]  # [(role, content), ...] у хронологічному порядку
+    tokens: int
+
+# === Підрахунок токенів ========================================================
+# gpt-4o-mini використовує кодування o200k_base. tiktoken завантажує його
+# один раз; якщо це неможливо (немає мережі), рахуємо грубо: ~4 символи на токен.
+@lru_cache(maxsize=1)
+def _encoding():
+    import tiktoken
+
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        logging.warning("tiktoken encoding unavailable, estimating tokens by length")
+        return None
+
+def count_tokens(text: str) -> int:
+    enc = _encoding()
+    return len(enc.encode(text)) if enc is not None else (len(text) + 3) // 4
+
+def truncate_tokens(text: str, limit: int) -> str:
+    enc = _encoding()
+    if enc is None:
+        return text[: limit * 4]
+    tokens = enc.encode(text)
+    return text if len(tokens) <= limit else enc.decode(tokens[:limit])
+
+# === Побудова контексту ========================================================
+# summarize(попередній_підсумок, нові_повідомлення, ліміт_токенів) -> новий підсумок.
+Summarizer = Callable[[str, list[Tuple[str, str]], int], str]
+
+# Непідсумованих повідомлень буває більше, ніж вікно _MAX_MESSAGES: дрібні
+# репліки, що всі вміщуються в бюджет, або підсумовування довго не вдавалося.
+# Старші за вікно до промпта вже не потраплять, тож згортаємо їх у підсумок
+# сторінками від найстарішого, щоб вони не губилися мовчки. Повертає новий
+# підсумок, його upto_id і чи вдалося згорнути все до before_id.
+def _fold_backlog(
+    client_id: str, summary: str, upto_id: int, before_id: int, summarize: Summarizer, budget: int
+) -> Tuple[str, int, bool]:
+    while page := storage.messages_between(client_id, upto_id, before_id, limit=_MAX_MESSAGES):
+        try:
+            with metrics.stage("summarize"):
+                new_summary = summarize(summary, [(r, c) for _, r, c in page], budget)
+        except Exception:
+            logging.exception(f"Failed to summarize older history for {client_id}")
+            return summary, upto_id, False
+        summary = truncate_tokens(new_summary.strip(), budget)
+        upto_id = page[-1][0]
+        storage.save_summary(client_id, summary, upto_id)
+    return summary, upto_id, True
+
+def build_context(client_id: str, summarize: Summarizer) -> ConversationContext:
+    budget = settings.HISTORY_TOKEN_BUDGET
+    summary_budget = settings.SUMMARY_TOKEN_BUDGET
+    with metrics.stage("history_read"):
+        summary, upto_id = storage.get_summary(client_id)
+        rows = storage.messages_after(client_id, upto_id, limit=_MAX_MESSAGES)  # від найновішого
+    folded = True
+    if len(rows) == _MAX_MESSAGES:
+        summary, upto_id, folded = _fold_backlog(client_id, summary, upto_id, rows[-1][0], summarize, summary_budget)
+
+    # 1) Набираємо найновіші повідомлення, поки вміщуються в бюджет.
+    kept, used = [], 0
+    for _, role, content in rows:
+        cost = count_tokens(content) + _PER_MESSAGE_TOKENS
+        if used + cost > budget:
+            if not kept:
+                # Навіть одне останнє повідомлення завелике – обрізаємо його.
+                content = truncate_tokens(content, max(budget - _PER_MESSAGE_TOKENS, 0))
+                kept.append((role, content))
+                used = budget
+            break
+        kept.append((role, content))
+        used += cost
+
+    # 2) Те, що не вмістилося, згортаємо в підсумок. Щоб не викликати LLM на
+    #    кожному ході, згортаємо з запасом: лишаємо дослівно лише половину
+    #    бюджету, тож наступні кілька ходів обійдуться без підсумовування.
+    #    Якщо старіші за вікно повідомлення згорнути не вдалося, upto_id не
+    #    пересуваємо через них – спробуємо знову на наступному ході.
+    if len(kept) < len(rows) and folded:
+        low_water, n, acc = budget // 2, 0, 0
+        for _, _, content in rows[: len(kept)]:
+            acc += count_tokens(content) + _PER_MESSAGE_TOKENS
+            if acc > low_water:
+                break
+            n += 1
+        n = max(n, 1)
+        overflow = rows[n:]
+        try:
+            with metrics.stage("summarize"):
+                new_summary = summarize(summary, [(r, c) for _, r, c in reversed(overflow)], summary_budget)
+        except Exception:
+            # Без підсумку розмова не ламається: просто працюємо з тим, що вміщується.
+            logging.exception(f"Failed to update conversation summary for {client_id}")
+        else:
+            summary = truncate_tokens(new_summary.strip(), summary_budget)
+            storage.save_summary(client_id, summary, overflow[0][0])
+            kept = kept[:n]
+            used = sum(count_tokens(c) + _PER_MESSAGE_TOKENS for _, c in kept)
+
+    return ConversationContext(
+        summary=summary,
+        turns=list(reversed(kept)),
+        tokens=used + count_tokens(summary),
+    )
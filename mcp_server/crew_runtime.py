@@ -1,15 +1,22 @@
-import os
-from urllib.parse import urljoin
-from pathlib import Path
-import requests
+import logging
+from contextlib import contextmanager
+from typing import Iterator
+
 from crewai import Agent, Task, Crew, Process, LLM
 from crewai.tools import tool
+from crewai.utilities.string_utils import sanitize_tool_name
 from crewai_tools import MCPServerAdapter
 from mcp import StdioServerParameters
 
+from . import api_proxy, metrics
 from .config import settings
-from .rag import build_or_load_retriever
-from .export_openapi import write_yaml_openapi
+from .rag import AnswerCache, build_or_load_hybrid_retriever
+from .openapi_catalog import SpecSnapshot, current_spec, spec_cache
+from .components import LazyComponent
+from .mcp_pool import MCPSessionPool
+from .streaming import RunEvents, bind, install, step_event
+from .scheduler import CancelToken
+from .context import build_context
 
 # ---------------------------------------------------------------------------
 #  Тут ми поєднуємо кілька складових:
@@ -18,60 +25,161 @@ from .export_openapi import write_yaml_openapi
 #      на інструменти;
 #    * CrewAI – надбудова над LLM, яка дозволяє керувати агентами та задачами.
 #  Коментарі націлені на тих, хто вперше стикається з цими бібліотеками.
+#
+#  Важкі об'єкти (LLM, RAG-індекс, OpenAPI-специфікація, каталог інструментів)
+#  загорнуті в LazyComponent: вони створюються під час першого використання
+#  або фонового прогріву після старту сервера, а не під час імпорту модуля.
 # ---------------------------------------------------------------------------
 
+install()  # направляємо події CrewAI (токени, інструменти) у стріми запитів
+
 # === Ініціалізація LLM ========================================================
 # LLM – обгортка CrewAI, яка знає як викликати модель. Параметр stream=False
 # означає, що ми отримуватимемо весь текст одразу. Ключ до OpenAI беремо зі
 # змінних середовища (через Settings у config.py).
-llm = LLM(model="openai/gpt-4o-mini", stream=False, api_key=settings.OPENAI_API_KEY)
+llm = LazyComponent("llm", lambda: LLM(
+    model="openai/gpt-4o-mini", stream=False, api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL
+))
+
+# Для стрімінгу кожен запуск отримує власний LLM зі stream=True: CrewAI тоді
+# публікує кожен згенерований шматок тексту як подію, а окремий об'єкт
+# дозволяє однозначно зв'язати ці події з конкретним HTTP-запитом.
+def _streaming_llm() -> LLM:
+    return LLM(model="openai/gpt-4o-mini", stream=True, api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
 
 # === Налаштування RAG =========================================================
-# build_or_load_retriever() готує індекс із локальних текстових файлів і
-# повертає об'єкт, який може швидко знаходити релевантні документи.
-_retriever = build_or_load_retriever()
+# build_or_load_hybrid_retriever() готує індекс із локальних текстових файлів
+# і повертає гібридний пошук: BM25 за словами плюс FAISS за змістом. Запити,
+# що дослівно є в документах (X-API-Key, назва інструмента), обслуговує сам
+# BM25 – без звернення до OpenAI за ембедингом, а повторні запити агента
+# відповідаються з кешу (query_cache) без ембедингу та пошуку у FAISS.
+# З RAG_SHARED_INDEX=true індекс не будується в процесі сервера: береться
+# покоління, опубліковане будівником, спільне для всіх робочих процесів.
+retriever = LazyComponent("retriever", build_or_load_hybrid_retriever)
 
 @tool("RAG Search")
-def rag_search(query: str) -> str:
-    """Повертає релевантні уривки з бази знань для запиту."""
-    docs = _retriever.get_relevant_documents(query)
+def rag_search(query: str, k: int = settings.RAG_TOP_K) -> str:
+    """Повертає k релевантних уривків з бази знань для запиту."""
+    with metrics.stage("rag_retrieval"):
+        docs, path = retriever.get().search(query, k)
+    metrics.rag_queries.inc(path)
     return "\n\n".join([f"[{i+1}] {d.page_content}" for i, d in enumerate(docs)])
 
+# === Кеш відповідей ============================================================
+# Вмикається ANSWER_CACHE_ENABLED. Ділитися між клієнтами можна лише
+# відповіддю, яка спирається на саму базу знань: якщо агент викликав хоча б
+# один інструмент MCP (тобто отримав дані з Dummy API за ключем клієнта),
+# або мав історію розмови (де можуть бути такі дані з попередніх
+# ходів), відповідь не зберігається. Область кешу – відбиток RAG-індексу та
+# версія специфікації: після їх зміни старі відповіді вже не знаходяться.
+answer_cache = AnswerCache(settings.ANSWER_CACHE_SIZE, settings.ANSWER_CACHE_TTL, settings.ANSWER_CACHE_SIMILARITY)
+
+def _answer_scope() -> str:
+    return f"{retriever.get().fingerprint}:{current_spec().digest[:16]}"
+
+def cached_answer(question: str) -> str | None:
+    with metrics.stage("answer_cache"):
+        return answer_cache.lookup(_answer_scope(), question, retriever.get().embed)
+
+# Повертає True, якщо відповідь збережено.
+def remember_answer(question: str, answer: str, events: RunEvents) -> bool:
+    if events.used_history or events.tools & events.mcp_tools:
+        answer_cache.refused += 1
+        return False
+    answer_cache.store(_answer_scope(), question, retriever.get().embed, answer)
+    return True
+
+# === Пул MCP-сесій ============================================================
+# Замість запуску нового процесу openapi-mcp на кожен запит беремо вже готову
+# сесію з пулу. Сесії розділені за API-ключем клієнта: ключ потрапляє у env
+# процесу і далі в заголовок X-API-Key, тому чужу сесію використати не можна.
+def _spawn_mcp(client_api_key: str, openapi_path: str) -> MCPServerAdapter:
+    # Готуємо параметри запуску MCP у stdio-режимі. Тут ми передаємо
+    # базову URL нашого Dummy API (через локальний кешувальний проксі, якщо
+    # він запущений) та API_KEY клієнта. MCPServerAdapter
+    # прочитає OpenAPI та перетворить кожен operationId на інструмент.
+    serverparams = StdioServerParameters(
+        command=settings.OPENAPI_MCP_BIN,
+        args=["--base-url", api_proxy.base_url(), openapi_path],
+        env={"API_KEY": client_api_key},
+    )
+    return MCPServerAdapter(serverparams)
+
+mcp_pool = MCPSessionPool(
+    spawn=_spawn_mcp,
+    max_size=settings.MCP_POOL_MAX_SIZE,
+    idle_ttl=settings.MCP_POOL_IDLE_TTL,
+    acquire_timeout=settings.MCP_POOL_ACQUIRE_TIMEOUT,
+)
+
+# Ключ сесії містить шлях до файлу специфікації, а він змінюється разом із
+# вмістом. Після оновлення специфікації вільні сесії зі старим файлом уже
+# нікому не знадобляться – закриваємо їх одразу, не чекаючи idle_ttl.
+def _retire_stale_sessions(snapshot: SpecSnapshot) -> None:
+    mcp_pool.retire(lambda key: key[1] != snapshot.path)
+
+spec_cache.on_change(_retire_stale_sessions)
+
+# Під час скасування одразу зупиняємо процес MCP: виклик інструмента, що саме
+# виконується, завершиться помилкою, і агент не чекатиме на нього. Реєстрацію
+# знімаємо до повернення сесії в пул: пізнє скасування (дедлайн, розрив
+# з'єднання вже після роботи агента) не повинно зупинити сесію, яку тим часом
+# узяв інший запит з тим самим ключем.
+@contextmanager
+def _terminate_on_cancel(cancel: CancelToken, session) -> Iterator[None]:
+    unregister = cancel.on_cancel(session.terminate)
+    try:
+        yield
+    finally:
+        unregister()
+
 # === Головна функція ==========================================================
 # run_with_mcp – точка, де ми збираємо все разом: завантажуємо OpenAPI,
-# піднімаємо MCP‑сервер, створюємо агента CrewAI з RAG та інструментами і
+# беремо MCP‑сесію з пулу, створюємо агента CrewAI з RAG та інструментами і
 # виконуємо задачу.
 
-def run_with_mcp(user_query: str, chat_history: list[tuple[str, str]], client_api_key: str) -> str:
+def run_with_mcp(
+    user_query: str,
+    chat_history: list[tuple[str, str]],
+    client_api_key: str,
+    events: RunEvents | None = None,
+    cancel: CancelToken | None = None,
+    summary: str = "",
+) -> str:
     """
     Підключаємо MCP-сервер (OpenAPI -> інструменти), додаємо RAG і запускаємо Crew.
     Ключ клієнта передаємо в ENV змінній 'API_KEY' stdio-процесу MCP.
+    Якщо передано events, токени LLM, кроки агента та виклики інструментів
+    надсилаються туди одразу під час виконання. Якщо передано cancel, запуск
+    перериває себе (RunCancelled) після скасування токена.
     """
-    # 1) Переконуємось, що маємо локальну OpenAPI-специфікацію.
-    openapi_path = "openapi.yaml"
-    if not os.path.exists(openapi_path):
-        spec_url = urljoin(settings.DUMMY_API_URL.rstrip("/") + "/", "openapi.json")
-        resp = requests.get(spec_url, timeout=15)
-        resp.raise_for_status()
-        write_yaml_openapi(resp.json(), Path(openapi_path))
-
-    # 2) Готуємо параметри запуску MCP у stdio-режимі. Тут ми передаємо
-    #    базову URL нашого Dummy API та API_KEY клієнта.
-    serverparams = StdioServerParameters(
-        command=settings.OPENAPI_MCP_BIN,
-        args=["--base-url", settings.DUMMY_API_URL, openapi_path],
-        env={"API_KEY": client_api_key},
-    )
+    cancel = cancel or CancelToken()
+    # 1) Беремо поточний знімок OpenAPI-специфікації. Якщо під час запуску
+    #    специфікацію оновлять, цей запуск і далі працює зі своїм знімком.
+    with metrics.stage("openapi_spec"):
+        spec = current_spec()
 
-    # 3) Піднімаємо MCP-адаптер, який прочитає OpenAPI та перетворить
-    #    кожен operationId на інструмент, доступний нашому агенту.
-    mcp_adapter = MCPServerAdapter(serverparams)
-    try:
-        mcp_tools = mcp_adapter.tools  # список інструментів із Dummy API
+    # 2) Беремо з пулу MCP-сесію цього клієнта (або запускаємо нову, якщо
+    #    вільної немає). Після виконання задачі сесія повертається в пул.
+    cancel.raise_if_cancelled()
+    with mcp_pool.lease(client_api_key, spec.path) as mcp_session, _terminate_on_cancel(cancel, mcp_session):
+        mcp_tools = mcp_session.tools  # список інструментів із Dummy API
+        if events is not None:
+            # У подіях CrewAI ім'я інструмента буває як вихідним, так і
+            # нормалізованим (нативний виклик функцій) – запам'ятовуємо обидва.
+            events.mcp_tools = {name for t in mcp_tools for name in (t.name, sanitize_tool_name(t.name))}
         tools = [rag_search] + mcp_tools
 
-        # 4) Налаштовуємо агента CrewAI. Він отримує опис ролі, мети, бекграунду
+        # 3) Налаштовуємо агента CrewAI. Він отримує опис ролі, мети, бекграунду
         #    та список інструментів, якими може користуватися.
+        run_llm = _streaming_llm() if events is not None else llm.get()
+
+        # Після кожного кроку агента перевіряємо, чи запуск не скасовано,
+        # і повідомляємо клієнта про крок.
+        def step_callback(step):
+            cancel.raise_if_cancelled()
+            if events is not None:
+                events.emit("step", step_event(step))
         agent = Agent(
             role="MCP інтегрований асистент",
             goal=(
@@ -83,18 +191,22 @@ def run_with_mcp(user_query: str, chat_history: list[tuple[str, str]], client_ap
                 "Ти підключений до внутрішнього Dummy API через MCP, "
                 "маєш базу знань і можеш робити авторизовані запити."
             ),
-            llm=llm,
+            llm=run_llm,
             tools=tools,
             allow_delegation=False,
             verbose=True,
+            step_callback=step_callback,
         )
 
-        # 5) Формуємо задачу (Task) з урахуванням попередньої історії чату.
+        # 4) Формуємо задачу (Task) з урахуванням попередньої історії чату:
+        #    підсумку давньої частини розмови та останніх повідомлень дослівно.
         hist_text = "\n".join([f"{r.upper()}: {c}" for r, c in chat_history])
+        summary_text = f"Підсумок попередньої розмови:\n{summary}\n\n" if summary else ""
         task = Task(
             description=(
                 "Останній запит користувача:\n"
                 f"{user_query}\n\n"
+                f"{summary_text}"
                 "Історія чату для контексту:\n"
                 f"{hist_text}"
             ),
@@ -102,7 +214,7 @@ def run_with_mcp(user_query: str, chat_history: list[tuple[str, str]], client_ap
             agent=agent,
         )
 
-        # 6) Crew – контейнер, який запускає послідовність задач агентів.
+        # 5) Crew – контейнер, який запускає послідовність задач агентів.
         crew = Crew(
             agents=[agent],
             tasks=[task],
@@ -110,8 +222,74 @@ def run_with_mcp(user_query: str, chat_history: list[tuple[str, str]], client_ap
             verbose=True
         )
 
-        result = crew.kickoff()
+        with metrics.stage("agent_kickoff"):
+            if events is None:
+                result = crew.kickoff()
+            else:
+                with bind(events, agent, run_llm):
+                    result = crew.kickoff()
+        cancel.raise_if_cancelled()
         return str(result)
-    finally:
-        # 7) Завжди закриваємо підключення до MCP, щоб не залишати висячі процеси.
-        mcp_adapter.stop()
+
+# === Контекст розмови ==========================================================
+# Оновлює накопичувальний підсумок: до попереднього підсумку дописуємо
+# повідомлення, які щойно випали з бюджету контексту. Це окремий короткий
+# виклик LLM без агента та інструментів.
+def summarize_history(summary: str, messages: list[tuple[str, str]], max_tokens: int) -> str:
+    hist_text = "\n".join([f"{r.upper()}: {c}" for r, c in messages])
+    return llm.get().call([
+        {
+            "role": "system",
+            "content": (
+                "Ти стискаєш історію чату. Онови підсумок розмови, додавши до нього нові "
+                "повідомлення. Збережи факти, ідентифікатори, домовленості та відкриті питання. "
+                f"Пиши українською, не більше {max_tokens} токенів. Не додавай секретних ключів."
+            ),
+        },
+        {
+            "role": "user",
+            "content": f"Поточний підсумок:\n{summary or '(порожньо)'}\n\nНові повідомлення:\n{hist_text}",
+        },
+    ])
+
+# Один хід чату: будуємо контекст у межах бюджету токенів (за потреби
+# оновлюючи підсумок) і запускаємо агента. Виконується в потоці планувальника,
+# тож виклик LLM для підсумку не блокує сервер і враховується в дедлайні.
+# Частину запусків можна профілювати (PROFILE_SAMPLE_RATE, див. metrics.py).
+# З use_cache спершу шукаємо відповідь у кеші відповідей – лише для розмови
+# без історії (та сама умова, що й для збереження): посеред розмови
+# уточнювальне питання має сенс тільки в її контексті. Пошук іде вже після
+# допуску планувальником, тож ембединги питань обмежені тими самими лімітами.
+def run_chat_turn(
+    client_id: str,
+    user_query: str,
+    client_api_key: str,
+    events: RunEvents | None = None,
+    cancel: CancelToken | None = None,
+    use_cache: bool = False,
+) -> str:
+    with metrics.profiled("chat_turn"):
+        with metrics.stage("context_build"):
+            context = build_context(client_id, summarize_history)
+        used_history = bool(context.turns or context.summary)
+        if events is not None:
+            events.used_history = used_history
+        if use_cache and not used_history:
+            try:
+                cached = cached_answer(user_query)
+            except Exception:
+                logging.warning("Answer cache lookup failed", exc_info=True)
+                cached = None
+            if cached is not None:
+                if events is not None:
+                    events.cached = True
+                    events.emit("token", {"text": cached})
+                return cached
+        return run_with_mcp(
+            user_query,
+            context.turns,
+            client_api_key,
+            events=events,
+            cancel=cancel,
+            summary=context.summary,
+        )
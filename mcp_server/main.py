@@ -1,33 +1,89 @@
 import asyncio
+import importlib
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Header, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 
 from .config import settings
-from .storage import add, history
-from .crew_runtime import run_with_mcp
+from .storage import add_many
+from . import api_proxy, components, metrics, openapi_catalog, router
+from .components import LazyComponent
+from .streaming import RunEvents, format_sse
+from .scheduler import AgentScheduler, CancelToken, RunCancelled, SchedulerBusy
 
 # ---------------------------------------------------------------------------
 #  Цей модуль запускає основний FastAPI-сервер, який інтегрує одразу кілька
 #  технологій: LLM через CrewAI, механізм RAG та інструменти MCP. Кожен запит
 #  від користувача обробляється послідовно, результати зберігаються в SQLite,
-#  а відповідь стрімиться символ за символом. Нижче докладно пояснено кожен
-#  крок – як у лекції для розробників, які вперше стикаються з цими бібліотеками.
+#  а відповідь стрімиться клієнту подіями SSE у міру генерації. Нижче докладно
+#  пояснено кожен крок – як у лекції для розробників, які вперше стикаються з
+#  цими бібліотеками.
 # ---------------------------------------------------------------------------
 
+# === Лінивий імпорт CrewAI =====================================================
+# Імпорт crew_runtime тягне за собою CrewAI, LangChain і FAISS – це секунди.
+# Тому модуль завантажується у фоні після старту (або під час першого запиту),
+# а uvicorn відкриває порт одразу.
+runtime = LazyComponent("crew_runtime", lambda: importlib.import_module(".crew_runtime", __package__))
+
 # === Опис структури вхідного запиту ==========================================
 # Pydantic BaseModel описує тіло POST-запиту. Ми очікуємо ідентифікатор клієнта
 # (щоб зберігати історію) та текст повідомлення для LLM.
 class ChatRequest(BaseModel):
     client_id: str
     message: str
+    # Дозволити швидкі шляхи без агента: прямі запити на кшталт "user123" та
+    # кеш відповідей (якщо його ввімкнено).
+    fast_path: bool = True
+
+# === Планувальник запусків агента ==============================================
+# Обмежує кількість одночасних запусків (загалом і на клієнта), тримає чергу
+# очікування та скасовує запуски після дедлайну або розриву з'єднання.
+scheduler = AgentScheduler(
+    workers=settings.AGENT_WORKERS,
+    per_client=settings.AGENT_MAX_PER_CLIENT,
+    max_queue=settings.AGENT_QUEUE_SIZE,
+    deadline=settings.AGENT_RUN_DEADLINE,
+)
+
+# === Життєвий цикл застосунку ==================================================
+# До yield: запускаємо фоновий прогрів компонентів (імпорт CrewAI, RAG-індекс,
+# LLM, OpenAPI, каталог інструментів) – сервер уже приймає з'єднання, а
+# готовність видно в /readyz – періодичну перевірку OpenAPI-специфікації
+# Dummy API на зміни та локальний кешувальний проксі перед Dummy API, через
+# який ходять інструменти MCP (api_proxy.py). Після yield (зупинка сервера): закриваємо всі
+# процеси openapi-mcp, які тримає пул, щоб не залишати їх висіти, і
+# зберігаємо кеш RAG-запитів, якщо ввімкнено RAG_CACHE_PERSIST.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up = asyncio.create_task(components.warm_up())
+    spec_refresh = asyncio.create_task(openapi_catalog.refresh_loop())
+    proxy = asyncio.create_task(api_proxy.serve()) if settings.API_PROXY_ENABLED else None
+    yield
+    warm_up.cancel()
+    spec_refresh.cancel()
+    await api_proxy.shutdown()
+    if proxy is not None:
+        try:
+            await proxy
+        except Exception:
+            logging.exception("Dummy API caching proxy stopped with an error")
+    scheduler.shutdown()
+    if runtime.ready:
+        await asyncio.to_thread(runtime.get().mcp_pool.close)
+        # rag уже імпортований разом з crew_runtime, тож цей імпорт нічого не коштує.
+        from .rag import query_cache
+        await asyncio.to_thread(query_cache().save)
 
 # === Ініціалізація FastAPI ======================================================
 app = FastAPI(
     title="MCP + CrewAI Server",
     description="Приймає client_id, message; стрімить відповідь; зберігає історію; використовує RAG і MCP-інструменти.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # === Основний ендпоїнт =========================================================
@@ -40,32 +96,273 @@ async def chat_stream(req: ChatRequest, x_api_key: str | None = Header(None)):
     if not x_api_key:
         raise HTTPException(status_code=401, detail="X-API-Key header is required")
 
-    # 2) Витягуємо останні 20 повідомлень із бази, щоб підтримувати контекст.
-    chat_hist = history(req.client_id, limit=20)
-
-    # 3) Запускаємо синхронну функцію run_with_mcp у пулі потоків.
-    loop = asyncio.get_event_loop()
-    result_text = await loop.run_in_executor(
-        None,
-        run_with_mcp,  # функція, що поєднує CrewAI + MCP
-        req.message,
-        chat_hist,
-        x_api_key,
-    )
-
-    # 4) Створюємо генератор, який "друкує" відповідь поступово.
-    async def generator():
-        # Виводимо відповідь по символах з невеликою затримкою, імітуючи набір тексту.
-        for ch in result_text:
-            yield ch
-            await asyncio.sleep(0.005)
-
-        # Після завершення зберігаємо історію діалогу в базу даних.
-        add(req.client_id, "user", req.message)
-        add(req.client_id, "assistant", result_text)
-
-    # 5) Повертаємо StreamingResponse, щоб клієнт міг отримувати текст у реальному часі.
-    return StreamingResponse(generator(), media_type="text/plain")
+    # Траса запиту: кожен етап (маршрутизатор, контекст, MCP, LLM, інструменти)
+    # додає до неї свій час. Планувальник копіює контекст у робочий потік, тож
+    # етапи всередині агента теж потрапляють сюди.
+    trace = metrics.RequestTrace()
+    metrics.current_trace.set(trace)
+
+    # 2) Швидкий шлях: якщо запит – це прямий пошук однієї сутності, відповідаємо
+    #    одним викликом Dummy API без агента та LLM.
+    if settings.ROUTER_ENABLED and req.fast_path:
+        with metrics.stage("fast_path"):
+            routed = await router.try_route(req.message, x_api_key)
+        if routed is not None:
+            metrics.requests_total.inc("fast_path", "ok")
+            return StreamingResponse(
+                _routed_stream(req, routed, trace),
+                media_type="text/event-stream",
+                headers={"Server-Timing": trace.server_timing()},
+            )
+
+    # 3) Інакше потрібен агент. Якщо прогрів ще не дійшов до crew_runtime,
+    #    чекаємо на нього (або імпортуємо самі). Помилка ініціалізації – це 503, а не падіння процесу.
+    try:
+        with metrics.stage("runtime_init"):
+            crew_runtime = await asyncio.to_thread(runtime.get)
+    except Exception as e:
+        metrics.requests_total.inc("agent", "unavailable")
+        raise HTTPException(status_code=503, detail=f"Server is not ready: {e}")
+
+    # 4) Такий самий запит уже обробляється (повтор, подвійний клік, друга
+    #    вкладка) – підключаємося до того запуску агента замість нового.
+    key = (req.client_id, x_api_key, req.message, req.fast_path)
+    if settings.CHAT_COALESCE and (shared := _joinable(key)) is not None:
+        return _join(shared, trace)
+
+    # 5) Передаємо хід чату планувальнику. run_chat_turn у робочому потоці
+    #    збирає контекст розмови в межах бюджету токенів (останні повідомлення
+    #    + накопичувальний підсумок), за потреби шукає відповідь у кеші
+    #    відповідей (ANSWER_CACHE_ENABLED) і запускає run_with_mcp, яка одразу
+    #    кладе токени LLM та кроки агента в чергу events, а SharedRun
+    #    паралельно віддає їх клієнту (і всім, хто підключився до запуску),
+    #    не чекаючи кінця роботи агента.
+    #    Якщо клієнт уже має забагато запусків або черга повна – відповідаємо
+    #    429 і підказуємо в Retry-After, коли варто спробувати знову.
+    events = RunEvents(asyncio.get_running_loop(), trace=trace)
+    cancel = scheduler.new_token()
+    try:
+        run = scheduler.submit(
+            req.client_id,
+            cancel,
+            crew_runtime.run_chat_turn,  # контекст + CrewAI + MCP
+            req.client_id,
+            req.message,
+            x_api_key,
+            events,
+            cancel,
+            settings.ANSWER_CACHE_ENABLED and req.fast_path,  # кеш відповідей
+        )
+    except SchedulerBusy as e:
+        metrics.requests_total.inc("agent", "rejected")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    run.add_done_callback(lambda _: events.close())
+
+    shared = SharedRun(key, req, run, events, cancel, crew_runtime)
+    if settings.CHAT_COALESCE:
+        _inflight[key] = shared
+    _coalesce_stats["runs"] += 1
+
+    # 6) Повертаємо StreamingResponse, щоб клієнт міг отримувати події в реальному часі.
+    #    Заголовок Server-Timing містить етапи до початку стріму; повну розбивку
+    #    (разом з LLM та інструментами) клієнт отримує в останній події timing.
+    return _SharedRunResponse(shared, trace)
+
+# === Спільний запуск агента ====================================================
+# Один запуск агента та всі запити, які до нього підключилися. Події стріму
+# форматуються один раз і зберігаються до кінця запуску, тож запит, що
+# підключився пізніше, отримує стрім з початку. Типи подій SSE:
+#   event: token       – черговий шматок тексту від LLM;
+#   event: step        – крок міркування агента;
+#   event: tool_call / tool_result / tool_error – виклики інструментів;
+#   event: done        – фінальна відповідь цілком ("cached": true – з кешу відповідей);
+#   event: error       – агент завершився з помилкою;
+#   event: timing      – останньою: час по етапах запуску в мілісекундах.
+# Хід діалогу записується в історію один раз, скільки б запитів не отримали
+# відповідь. Агента скасовуємо, лише коли відключилися всі слухачі.
+_inflight: dict[tuple[str, str, str, bool], "SharedRun"] = {}
+_coalesce_stats = {"runs": 0, "joined": 0}
+
+class SharedRun:
+    def __init__(self, key, req: ChatRequest, run: asyncio.Task, events: RunEvents, cancel: CancelToken, crew_runtime):
+        self.key = key
+        self.run = run
+        self.cancel = cancel
+        self.listeners = 1  # запит, який створив запуск
+        self._log: list[str] = []
+        self._changed = asyncio.Event()
+        self._finished = False
+        self._pump = asyncio.create_task(self._collect(req, events, crew_runtime))
+
+    def _append(self, chunk: str) -> None:
+        self._log.append(chunk)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _collect(self, req: ChatRequest, events: RunEvents, crew_runtime) -> None:
+        async for event, data in events:
+            self._append(format_sse(event, data))
+
+        result_text = None
+        if self.run.cancelled():
+            metrics.requests_total.inc("agent", "cancelled")
+            self._append(format_sse("error", {"detail": f"run cancelled: {self.cancel.reason}"}))
+        else:
+            try:
+                result_text = self.run.result()
+            except RunCancelled as e:
+                metrics.requests_total.inc("agent", "cancelled")
+                self._append(format_sse("error", {"detail": f"run cancelled: {e}"}))
+            except Exception as e:
+                metrics.requests_total.inc("agent", "error")
+                self._append(format_sse("error", {"detail": str(e)}))
+            else:
+                if events.cached:
+                    metrics.requests_total.inc("answer_cache", "ok")
+                    self._append(format_sse("done", {"text": result_text, "cached": True}))
+                else:
+                    metrics.requests_total.inc("agent", "ok")
+                    self._append(format_sse("done", {"text": result_text}))
+                # Після завершення ставимо хід діалогу в чергу на запис у базу даних.
+                add_many(req.client_id, [("user", req.message), ("assistant", result_text)])
+        self._append(format_sse("timing", events.trace.timings_ms()))
+        self._finished = True
+        self._changed.set()
+        if _inflight.get(self.key) is self:
+            del _inflight[self.key]
+
+        # Клієнти вже отримали відповідь; ембединг питання для кешу рахуємо після.
+        if result_text is not None and settings.ANSWER_CACHE_ENABLED and not events.cached:
+            try:
+                await asyncio.to_thread(crew_runtime.remember_answer, req.message, result_text, events)
+            except Exception:
+                logging.warning("Failed to store the answer in the answer cache", exc_info=True)
+
+    async def stream(self):
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self._log):
+                yield self._log[sent]
+                sent += 1
+            if self._finished:
+                return
+            await changed.wait()
+
+    def leave(self) -> None:
+        # Якщо слухачів не лишилося – скасовуємо агента, щоб він не витрачав
+        # токени, і одразу прибираємо запуск з _inflight: новий такий самий
+        # запит має стартувати власний запуск, а не підключитися до скасованого.
+        self.listeners -= 1
+        if self.listeners == 0 and not self.run.done():
+            if _inflight.get(self.key) is self:
+                del _inflight[self.key]
+            self.cancel.cancel("client disconnected")
+            self.run.cancel()
+
+class _SharedRunResponse(StreamingResponse):
+    # Слухача знімаємо у __call__, а не у finally генератора: якщо клієнт
+    # відключився ще до першої події, Starlette взагалі не запускає генератор,
+    # і його finally не виконується.
+    def __init__(self, shared: SharedRun, trace: metrics.RequestTrace):
+        super().__init__(
+            shared.stream(),
+            media_type="text/event-stream",
+            headers={"Server-Timing": trace.server_timing()},
+        )
+        self._shared = shared
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._shared.leave()
+
+def _joinable(key) -> SharedRun | None:
+    shared = _inflight.get(key)
+    if shared is None or shared.cancel.cancelled or shared.run.done():
+        return None
+    return shared
+
+def _join(shared: SharedRun, trace: metrics.RequestTrace) -> StreamingResponse:
+    shared.listeners += 1
+    _coalesce_stats["joined"] += 1
+    metrics.requests_total.inc("agent", "coalesced")
+    return _SharedRunResponse(shared, trace)
+
+# Відповідь швидкого шляху у тому самому форматі SSE, що й відповідь агента.
+async def _routed_stream(req: ChatRequest, routed: router.RoutedAnswer, trace: metrics.RequestTrace):
+    yield format_sse("tool_call", {"tool": routed.tool, "args": routed.args, "fast_path": True})
+    yield format_sse("token", {"text": routed.text})
+    yield format_sse("done", {"text": routed.text})
+    add_many(req.client_id, [("user", req.message), ("assistant", routed.text)])
+    yield format_sse("timing", trace.timings_ms())
+
+# === Метрики Prometheus ========================================================
+# Гістограми тривалості етапів, лічильники токенів, викликів інструментів і
+# помилок, а також поточний стан пулу MCP, планувальника та маршрутизатора.
+@app.get("/metrics")
+async def prometheus_metrics():
+    gauges = {
+        "router": router.stats(),
+        "scheduler": scheduler.stats(),
+        "openapi": openapi_catalog.spec_cache.stats(),
+        "api_proxy": api_proxy.proxy.stats(),
+    }
+    gauges["coalescing"] = {"inflight": len(_inflight), **_coalesce_stats}
+    if runtime.ready:
+        gauges["mcp_pool"] = runtime.get().mcp_pool.stats()
+        if settings.ANSWER_CACHE_ENABLED:
+            gauges["answer_cache"] = runtime.get().answer_cache.stats()
+        if runtime.get().retriever.ready:
+            gauges["rag"] = runtime.get().retriever.get().stats()
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+# === Статистика швидкого шляху =================================================
+@app.get("/router")
+async def router_stats():
+    return router.stats()
+
+# === Метрики пулу MCP ==========================================================
+# Частка влучань у пул, кількість запусків процесів та їхня тривалість.
+@app.get("/mcp/pool")
+async def mcp_pool_stats():
+    return runtime.get().mcp_pool.stats() if runtime.ready else {}
+
+# === Кеш проксі Dummy API ======================================================
+# Частка влучань, злиті однакові запити та середній час відповіді Dummy API.
+@app.get("/api-proxy")
+async def api_proxy_stats():
+    return api_proxy.proxy.stats()
+
+# === Злиття запитів і кеш відповідей ===========================================
+# Скільки запусків агента зараз виконується, скільки запитів підключилися до
+# вже запущених та статистика кешу відповідей.
+@app.get("/coalescing")
+async def coalescing_stats():
+    stats: dict = {"inflight": len(_inflight), **_coalesce_stats}
+    if settings.ANSWER_CACHE_ENABLED and runtime.ready:
+        stats["answer_cache"] = runtime.get().answer_cache.stats()
+    return stats
+
+# === Стан планувальника ========================================================
+@app.get("/scheduler")
+async def scheduler_stats():
+    return scheduler.stats()
+
+# === Перевірки стану ===========================================================
+# /healthz (liveness) – процес живий і обробляє запити.
+# /readyz (readiness) – усі компоненти ініціалізовано; поки ні – 503 і
+# статус кожного компонента, щоб балансувальник не слав сюди трафік.
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    ready = components.all_ready()
+    body = {"ready": ready, "components": components.readiness()}
+    return JSONResponse(body, status_code=200 if ready else 503)
 
 # === Точка входу ===============================================================
 if __name__ == "__main__":
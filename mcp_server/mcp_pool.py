@@ -0,0 +1,293 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator
+
+from . import metrics
+
+# ---------------------------------------------------------------------------
+#  Пул довгоживучих MCP-сесій. Запуск openapi-mcp – це fork/exec процесу,
+#  розбір OpenAPI та опитування списку інструментів, тому робити це на кожен
+#  запит чату дорого. Пул тримає вже запущені сесії, згруповані за API-ключем
+#  клієнта (ключ передається процесу через env API_KEY, тож сесію одного
+#  клієнта не можна віддати іншому), і видає їх у тимчасове користування.
+#
+#  Що вміє пул:
+#    * обмежує загальну кількість процесів (max_size), витісняючи найдавніше
+#      використану вільну сесію, коли місця немає;
+#    * закриває сесії, які простоюють довше за idle_ttl;
+#    * перевіряє, що процес живий, і перезапускає сесію після падіння;
+#    * закриває вільні сесії, що стали непотрібні (retire), – наприклад,
+#      прив'язані до старої версії OpenAPI-специфікації;
+#    * рахує метрики: частку влучань, кількість і тривалість запусків.
+# ---------------------------------------------------------------------------
+
+class PoolExhausted(RuntimeError):
+    """Усі сесії зайняті, і за відведений час жодна не звільнилася."""
+
+@dataclass
+class MCPSession:
+    key: tuple[str, str]
+    adapter: Any
+    tools: list
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    # Позначка, що сесію не можна повертати в пул (наприклад, запит скасовано
+    # посеред виклику інструмента і стан stdio-каналу невідомий).
+    broken: bool = False
+    _stopped: bool = field(default=False, repr=False)
+    _stop_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def terminate(self) -> None:
+        """Зупиняє процес MCP. Безпечно викликати кілька разів і з різних потоків."""
+        with self._stop_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self.broken = True
+        self.adapter.stop()
+
+    def healthy(self) -> bool:
+        # MCPAdapt обслуговує stdio-з'єднання у власному потоці. Коли процес
+        # openapi-mcp завершується, цикл подій у потоці зупиняється.
+        thread = getattr(getattr(self.adapter, "_adapter", None), "thread", None)
+        return not self.broken and (thread is None or thread.is_alive())
+
+class MCPSessionPool:
+    def __init__(
+        self,
+        spawn: Callable[[str, str], Any],
+        max_size: int = 8,
+        idle_ttl: float = 300.0,
+        acquire_timeout: float = 30.0,
+    ):
+        # spawn(api_key, openapi_path) -> MCPServerAdapter
+        self._spawn = spawn
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.acquire_timeout = acquire_timeout
+
+        self._cond = threading.Condition()
+        self._idle: dict[tuple[str, str], list[MCPSession]] = {}
+        self._busy = 0
+        self._reserved = 0  # слоти, під які саме зараз запускається процес
+        self._closed = False
+        self._reaper: threading.Thread | None = None
+        self._stats = {
+            "leases": 0,
+            "hits": 0,
+            "misses": 0,
+            "spawns": 0,
+            "spawn_errors": 0,
+            "spawn_seconds_total": 0.0,
+            "spawn_seconds_max": 0.0,
+            "evicted_idle": 0,
+            "evicted_lru": 0,
+            "retired": 0,
+            "restarts": 0,
+        }
+
+    # === Видача сесії ============================================================
+    @contextmanager
+    def lease(self, api_key: str, openapi_path: str) -> Iterator[MCPSession]:
+        """Видає сесію для ключа на час блоку with і повертає її в пул після."""
+        with metrics.stage("mcp_acquire"):
+            session = self._acquire((api_key, openapi_path))
+        try:
+            yield session
+        finally:
+            # Під час повернення перевіряємо процес: якщо він впав, сесію треба
+            # викинути, інакше наступний клієнт отримає мертве з'єднання.
+            self._release(session)
+
+    def _acquire(self, key: tuple[str, str]) -> MCPSession:
+        self._ensure_reaper()
+        to_stop = []
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("MCP session pool is closed")
+            self._stats["leases"] += 1
+            while True:
+                sessions = self._idle.get(key, [])
+                while sessions:
+                    session = sessions.pop()
+                    if session.healthy():
+                        self._busy += 1
+                        self._stats["hits"] += 1
+                        self._drop_empty(key)
+                        break
+                    to_stop.append(session)
+                    self._stats["restarts"] += 1
+                else:
+                    session = None
+                if session is not None:
+                    break
+                self._drop_empty(key)
+                if self._size() < self.max_size:
+                    self._reserved += 1
+                    self._stats["misses"] += 1
+                    break
+                victim = self._pop_lru()
+                if victim is not None:
+                    to_stop.append(victim)
+                    self._stats["evicted_lru"] += 1
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted(f"all {self.max_size} MCP sessions are busy")
+                self._cond.wait(remaining)
+
+        self._stop_all(to_stop)
+        if session is not None:
+            session.last_used = time.monotonic()
+            return session
+        return self._spawn_reserved(key)
+
+    def _spawn_reserved(self, key: tuple[str, str]) -> MCPSession:
+        started = time.monotonic()
+        try:
+            adapter = self._spawn(*key)
+            session = MCPSession(key=key, adapter=adapter, tools=list(adapter.tools))
+        except BaseException:
+            with self._cond:
+                self._reserved -= 1
+                self._stats["spawn_errors"] += 1
+                self._cond.notify()
+            raise
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._reserved -= 1
+            self._busy += 1
+            self._stats["spawns"] += 1
+            self._stats["spawn_seconds_total"] += elapsed
+            self._stats["spawn_seconds_max"] = max(self._stats["spawn_seconds_max"], elapsed)
+        # Запуск процесу разом із отриманням списку інструментів (tools/list).
+        metrics.observe("mcp_spawn", elapsed)
+        logging.info(f"Spawned MCP session in {elapsed * 1000:.0f} ms")
+        return session
+
+    def _release(self, session: MCPSession) -> None:
+        session.last_used = time.monotonic()
+        keep = session.healthy() and not self._closed
+        with self._cond:
+            self._busy -= 1
+            if keep:
+                self._idle.setdefault(session.key, []).append(session)
+            elif not self._closed:
+                self._stats["restarts"] += 1
+            self._cond.notify()
+        if not keep:
+            self._stop_all([session])
+
+    # === Обслуговування ==========================================================
+    def _size(self) -> int:
+        return self._busy + self._reserved + sum(len(s) for s in self._idle.values())
+
+    def _drop_empty(self, key: tuple[str, str]) -> None:
+        if not self._idle.get(key, True):
+            del self._idle[key]
+
+    def _pop_lru(self) -> MCPSession | None:
+        candidates = [(s.last_used, key, i) for key, ss in self._idle.items() for i, s in enumerate(ss)]
+        if not candidates:
+            return None
+        _, key, i = min(candidates)
+        session = self._idle[key].pop(i)
+        self._drop_empty(key)
+        return session
+
+    def _stop_all(self, sessions: list[MCPSession]) -> None:
+        # stop() чекає завершення потоку MCPAdapt, тому викликаємо його поза
+        # блокуванням пулу.
+        for session in sessions:
+            try:
+                session.terminate()
+            except Exception:
+                logging.exception("Failed to stop MCP session")
+
+    def evict_idle(self) -> None:
+        """Закриває сесії, що простоюють довше за idle_ttl, і перезапускає мертві."""
+        now = time.monotonic()
+        expired, dead = [], []
+        with self._cond:
+            for key in list(self._idle):
+                alive = []
+                for session in self._idle[key]:
+                    if now - session.last_used > self.idle_ttl:
+                        expired.append(session)
+                    elif not session.healthy():
+                        dead.append(session)
+                    else:
+                        alive.append(session)
+                self._idle[key] = alive
+                self._drop_empty(key)
+            self._stats["evicted_idle"] += len(expired)
+            self._stats["restarts"] += len(dead)
+            self._reserved += len(dead)
+            self._cond.notify_all()
+        self._stop_all(expired + dead)
+
+        # Впалі сесії ще не прострочені, тобто клієнт активний – піднімаємо
+        # заміну одразу, щоб наступний запит не чекав на запуск процесу.
+        for session in dead:
+            try:
+                fresh = self._spawn_reserved(session.key)
+            except Exception:
+                logging.exception("Failed to restart MCP session")
+                continue
+            self._release(fresh)
+
+    def retire(self, stale: Callable[[tuple[str, str]], bool]) -> int:
+        """Закриває вільні сесії, ключ яких більше не потрібен (stale(key) == True)."""
+        retired = []
+        with self._cond:
+            for key in [k for k in self._idle if stale(k)]:
+                retired += self._idle.pop(key)
+            self._stats["retired"] += len(retired)
+            self._cond.notify_all()
+        self._stop_all(retired)
+        return len(retired)
+
+    def _ensure_reaper(self) -> None:
+        if self._reaper is not None:
+            return
+        with self._cond:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="mcp-pool-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self) -> None:
+        interval = max(1.0, min(self.idle_ttl / 2, 30.0))
+        while not self._closed:
+            time.sleep(interval)
+            try:
+                self.evict_idle()
+            except Exception:
+                logging.exception("MCP pool maintenance failed")
+
+    def close(self) -> None:
+        """Зупиняє всі вільні сесії; зайняті будуть зупинені під час повернення."""
+        with self._cond:
+            self._closed = True
+            sessions = [s for ss in self._idle.values() for s in ss]
+            self._idle.clear()
+            self._cond.notify_all()
+        self._stop_all(sessions)
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._size()
+            stats["busy"] = self._busy
+            stats["idle"] = stats["size"] - self._busy - self._reserved
+            stats["max_size"] = self.max_size
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["spawn_seconds_avg"] = (
+            stats["spawn_seconds_total"] / stats["spawns"] if stats["spawns"] else 0.0
+        )
+        return stats
@@ -0,0 +1,183 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from .config import settings
+
+# ---------------------------------------------------------------------------
+#  Метрики та трасування етапів запиту. Повільний /chat/stream може втрачати
+#  час будь-де: читання історії, перевірка OpenAPI, запуск MCP, пошук у RAG,
+#  виклики LLM та інструментів, запис історії. Тут зібрано:
+#    * Counter та Histogram у стилі Prometheus і функцію render(), яка віддає
+#      їх у текстовому форматі для /metrics (без сторонніх бібліотек);
+#    * stage(name) – контекстний менеджер, який міряє етап, записує його в
+#      гістограму stage_seconds і в трасу поточного запиту (RequestTrace);
+#    * трасу запиту: сума часу по етапах, з якої будується заголовок
+#      Server-Timing та підсумкова подія стріму;
+#    * необов'язковий семплінговий профайлер (pyinstrument) для повільних запусків.
+# ---------------------------------------------------------------------------
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _num(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+# === Типи метрик ===============================================================
+_registry: list = []
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_num(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=_DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, tuple(buckets)
+        # labels -> [лічильники по бакетах..., сума, кількість]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, state in sorted(self._values.items()):
+                for bound, count in zip((*self.buckets, "+Inf"), (*state[:-2], state[-1])):
+                    le = _labels(self.labelnames, labels, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{le} {_num(count)}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(state[-2])}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {_num(state[-1])}")
+        return lines
+
+# === Метрики сервера ===========================================================
+stage_seconds = Histogram("mcp_server_stage_seconds", "Duration of request processing stages", ("stage",))
+stage_errors = Counter("mcp_server_stage_errors_total", "Errors raised inside a processing stage", ("stage",))
+llm_tokens = Counter("mcp_server_llm_tokens_total", "LLM tokens consumed", ("direction",))
+tool_calls = Counter("mcp_server_tool_calls_total", "Agent tool invocations", ("tool", "status"))
+requests_total = Counter("mcp_server_chat_requests_total", "Chat requests by outcome", ("path", "outcome"))
+rag_queries = Counter("mcp_server_rag_queries_total", "RAG searches by retrieval path", ("path",))
+
+# Стан пулів та планувальника віддаємо як gauge: gauges={"mcp_pool": {...}}.
+def render(gauges: dict[str, dict] | None = None) -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for prefix, values in (gauges or {}).items():
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                name = f"mcp_server_{prefix}_{key}"
+                lines += [f"# TYPE {name} gauge", f"{name} {_num(value)}"]
+    return "\n".join(lines) + "\n"
+
+# === Траса запиту ==============================================================
+class RequestTrace:
+    """Сумарний час по етапах одного запиту. Етапи можуть приходити з різних потоків."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._timings: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._timings[stage] = self._timings.get(stage, 0.0) + seconds
+
+    def timings_ms(self) -> dict[str, float]:
+        with self._lock:
+            timings = dict(self._timings)
+        timings["total"] = time.monotonic() - self.started
+        return {k: round(v * 1000, 1) for k, v in timings.items()}
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{k};dur={v}" for k, v in self.timings_ms().items())
+
+# Поточна траса. Планувальник копіює контекст у робочий потік, тож етапи,
+# виміряні всередині агента, теж потрапляють у трасу свого запиту.
+current_trace: contextvars.ContextVar[RequestTrace | None] = contextvars.ContextVar("current_trace", default=None)
+
+def observe(stage: str, seconds: float, trace: RequestTrace | None = None) -> None:
+    stage_seconds.observe(seconds, stage)
+    trace = trace or current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(name)
+        raise
+    finally:
+        observe(name, time.perf_counter() - started)
+
+# === Профайлер повільних запусків ==============================================
+# PROFILE_SAMPLE_RATE – частка запусків, які профілюються; звіт зберігається
+# лише якщо запуск тривав довше за PROFILE_SLOW_MS. pyinstrument – необов'язкова
+# залежність: без неї хук просто вимкнений.
+_PROFILE_DIR = Path(__file__).parent / "profiles"
+
+@contextmanager
+def profiled(name: str) -> Iterator[None]:
+    if settings.PROFILE_SAMPLE_RATE <= 0 or random.random() >= settings.PROFILE_SAMPLE_RATE:
+        yield
+        return
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        logging.warning("PROFILE_SAMPLE_RATE is set but pyinstrument is not installed")
+        yield
+        return
+
+    profiler = Profiler(async_mode="disabled")
+    profiler.start()
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        elapsed_ms = (time.monotonic() - started) * 1000
+        if elapsed_ms >= settings.PROFILE_SLOW_MS:
+            _PROFILE_DIR.mkdir(exist_ok=True)
+            path = _PROFILE_DIR / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed_ms)}ms.txt"
+            path.write_text(profiler.output_text(unicode=True), encoding="utf-8")
+            logging.warning(f"Slow {name} ({elapsed_ms:.0f} ms) profiled to {path}")
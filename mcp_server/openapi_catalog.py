@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+from urllib.parse import urljoin
+
+import httpx
+import yaml
+
+from . import metrics
+from .config import settings
+from .components import LazyComponent
+from .export_openapi import write_yaml_openapi
+
+# ---------------------------------------------------------------------------
+#  OpenAPI-специфікація Dummy API та каталог MCP-інструментів. openapi-mcp
+#  перетворює кожну операцію (operationId) на окремий інструмент, тому
+#  каталог можна скласти прямо зі специфікації, не запускаючи процес MCP.
+#
+#  Специфікація кешується як незмінний знімок (SpecSnapshot): YAML-файл,
+#  названий за хешем вмісту, разом із уже складеним каталогом. Фонова задача
+#  раз на OPENAPI_REFRESH_INTERVAL секунд умовно перезапитує /openapi.json
+#  (If-None-Match, якщо сервер віддає ETag, інакше порівнюємо хеш вмісту) і,
+#  якщо специфікація змінилася, атомарно підміняє знімок. Запит, який уже
+#  взяв знімок, працює з ним до кінця: старий файл лишається на диску, а MCP-
+#  сесії прив'язані до шляху файлу, тож нові запити отримують нові сесії.
+# ---------------------------------------------------------------------------
+
+_HTTP_METHODS = {"get", "post", "put", "patch", "delete"}
+
+# Кеш специфікацій: openapi-<хеш>.yaml та meta.json з ETag і поточним файлом.
+_CACHE_DIR = Path(__file__).parent / ".openapi_cache"
+_META_NAME = "meta.json"
+
+# Скільки останніх версій файлу тримати на диску (поточна + попередня).
+_KEEP_VERSIONS = 2
+
+# Старіші версії видаляємо лише через цей час після останнього використання:
+# з uvicorn --workers N каталог спільний, і інший процес може ще працювати зі
+# своїм знімком, поки його фонове оновлення не підхопить нову специфікацію.
+_MIN_PRUNE_AGE = 600.0
+
+def _prune_age() -> float:
+    return max(_MIN_PRUNE_AGE, 3 * settings.OPENAPI_REFRESH_INTERVAL)
+
+# Ім'я схеми відповіді 200 (наприклад, "UserInfo") – з $ref на components/schemas.
+def _response_schema(op: dict) -> str | None:
+    content = (op.get("responses", {}).get("200") or {}).get("content", {})
+    ref = (content.get("application/json") or {}).get("schema", {}).get("$ref", "")
+    return ref.rsplit("/", 1)[-1] or None
+
+# Каталог: один запис на операцію – ім'я інструмента (operationId), HTTP-метод,
+# шлях, параметри шляху/запиту, схема відповіді, короткий опис і теги.
+def build_catalog(spec: dict) -> list[dict]:
+    catalog = []
+    for path, item in (spec.get("paths") or {}).items():
+        for method, op in item.items():
+            if method not in _HTTP_METHODS:
+                continue
+            catalog.append({
+                "tool": op.get("operationId") or f"{method}_{path}",
+                "method": method.upper(),
+                "path": path,
+                "params": [p["name"] for p in op.get("parameters", []) if p.get("in") in ("path", "query")],
+                "path_params": [p["name"] for p in op.get("parameters", []) if p.get("in") == "path"],
+                "required_query": [
+                    p["name"] for p in op.get("parameters", []) if p.get("in") == "query" and p.get("required")
+                ],
+                "response": _response_schema(op),
+                "summary": op.get("summary", ""),
+                "tags": op.get("tags", []),
+            })
+    return catalog
+
+# === Знімок специфікації =======================================================
+@dataclass(frozen=True)
+class SpecSnapshot:
+    path: str             # YAML-файл для openapi-mcp (ім'я містить хеш вмісту)
+    digest: str           # sha256 канонічного JSON специфікації
+    etag: str | None      # ETag відповіді Dummy API, якщо він його надсилає
+    catalog: list[dict]   # складений каталог інструментів
+    generation: int       # номер версії в межах процесу: 1, 2, ...
+    loaded_at: float
+
+def _spec_url() -> str:
+    return urljoin(settings.DUMMY_API_URL.rstrip("/") + "/", "openapi.json")
+
+def _digest(spec: dict) -> str:
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+class SpecCache:
+    def __init__(self, cache_dir: Path):
+        self._dir = cache_dir
+        self._lock = threading.Lock()
+        self._snapshot: SpecSnapshot | None = None
+        self._listeners: list[Callable[[SpecSnapshot], None]] = []
+        self._stats = {"refreshes": 0, "not_modified": 0, "changes": 0, "errors": 0}
+        self._from_disk = False  # знімок узято з кешу на диску і ще не перевірено
+
+    @property
+    def snapshot(self) -> SpecSnapshot | None:
+        return self._snapshot
+
+    # Викликається після кожної підміни знімка (з потоку, що її зробив).
+    def on_change(self, callback: Callable[[SpecSnapshot], None]) -> None:
+        self._listeners.append(callback)
+
+    # === Диск ===
+    def _read_meta(self) -> dict | None:
+        try:
+            with (self._dir / _META_NAME).open(encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, spec: dict, digest: str, etag: str | None) -> Path:
+        self._dir.mkdir(exist_ok=True)
+        path = self._dir / f"openapi-{digest[:16]}.yaml"
+        if path.exists():
+            path.touch()  # mtime – час останнього використання, див. _prune
+        else:
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            write_yaml_openapi(spec, tmp)
+            os.replace(tmp, path)
+        meta_tmp = self._dir / f"{_META_NAME}.{os.getpid()}.tmp"
+        meta_tmp.write_text(json.dumps({"file": path.name, "digest": digest, "etag": etag}), encoding="utf-8")
+        os.replace(meta_tmp, self._dir / _META_NAME)
+        self._prune(keep=path)
+        return path
+
+    def _prune(self, keep: Path) -> None:
+        current = self._snapshot
+        keep_paths = {keep} | ({Path(current.path)} if current else set())
+        deadline = time.time() - _prune_age()
+        files = []
+        for f in self._dir.glob("openapi-*.yaml"):
+            try:
+                files.append((f.stat().st_mtime, f))
+            except OSError:
+                continue  # інший процес щойно видалив файл
+        files.sort(reverse=True)
+        for mtime, old in [(m, f) for m, f in files if f not in keep_paths][_KEEP_VERSIONS - 1:]:
+            if mtime < deadline:
+                old.unlink(missing_ok=True)
+
+    # === Підміна знімка ===
+    def _install(self, spec: dict, digest: str, etag: str | None, path: Path | None = None) -> SpecSnapshot:
+        path = path or self._write(spec, digest, etag)
+        catalog = build_catalog(spec)
+        with self._lock:
+            generation = self._snapshot.generation + 1 if self._snapshot else 1
+            snapshot = SpecSnapshot(str(path), digest, etag, catalog, generation, time.time())
+            self._snapshot = snapshot  # одне присвоєння – читачі бачать або старий, або новий знімок
+        if generation > 1:
+            self._stats["changes"] += 1
+            logging.info(f"OpenAPI spec changed, generation {generation} ({path.name})")
+            for callback in self._listeners:
+                try:
+                    callback(snapshot)
+                except Exception:
+                    logging.exception("OpenAPI change listener failed")
+        return snapshot
+
+    # Перший знімок: з дискового кешу, якщо він є (без мережі), інакше
+    # синхронно завантажуємо специфікацію. Фонове оновлення потім перевірить,
+    # чи кеш не застарів.
+    def load(self) -> SpecSnapshot:
+        if self._snapshot is not None:
+            return self._snapshot
+        meta = self._read_meta()
+        if meta and (self._dir / meta["file"]).exists():
+            path = self._dir / meta["file"]
+            with path.open(encoding="utf-8") as f:
+                spec = yaml.safe_load(f)
+            self._from_disk = True
+            return self._install(spec, meta["digest"], meta.get("etag"), path)
+
+        with metrics.stage("openapi_fetch"):
+            resp = httpx.get(_spec_url(), timeout=15)
+            resp.raise_for_status()
+        spec = resp.json()
+        return self._install(spec, _digest(spec), resp.headers.get("etag"))
+
+    # Умовна перевірка: повертає True, якщо знімок було підмінено.
+    async def refresh(self, client: httpx.AsyncClient) -> bool:
+        current = self._snapshot
+        headers = {"If-None-Match": current.etag} if current and current.etag else {}
+        self._stats["refreshes"] += 1
+        with metrics.stage("openapi_fetch"):
+            resp = await client.get(_spec_url(), headers=headers)
+        if resp.status_code == 304:
+            self._stats["not_modified"] += 1
+            return False
+        resp.raise_for_status()
+        spec = resp.json()
+        digest = _digest(spec)
+        if current is not None and digest == current.digest:
+            self._stats["not_modified"] += 1
+            return False
+        # Запис YAML та складання каталогу – у робочому потоці, не в циклі подій.
+        await asyncio.to_thread(self._install, spec, digest, resp.headers.get("etag"))
+        return True
+
+    async def run(self, interval: float) -> None:
+        # Перший знімок робить прогрів (або перший запит) – чекаємо на нього.
+        while self._snapshot is None:
+            await asyncio.sleep(1.0)
+        async with httpx.AsyncClient(timeout=15) as client:
+            while True:
+                # Знімок із диску міг застаріти, поки сервер не працював, – перевіряємо одразу.
+                await asyncio.sleep(0 if self._from_disk else interval)
+                self._from_disk = False
+                try:
+                    await self.refresh(client)
+                except Exception:
+                    # Мережа, некоректна специфікація, запис на диск (OSError) тощо:
+                    # фонова задача не повинна завершитися – спробуємо наступного разу.
+                    self._stats["errors"] += 1
+                    logging.warning("OpenAPI spec refresh failed; keeping the current snapshot", exc_info=True)
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            **self._stats,
+            "generation": snapshot.generation if snapshot else 0,
+            "age_seconds": round(time.time() - snapshot.loaded_at, 1) if snapshot else 0.0,
+            "operations": len(snapshot.catalog) if snapshot else 0,
+        }
+
+spec_cache = SpecCache(_CACHE_DIR)
+
+# Лінивий компонент для прогріву та /readyz: перший знімок специфікації.
+openapi_spec = LazyComponent("openapi_spec", spec_cache.load)
+
+# Поточний знімок. Запит бере його один раз і далі користується лише ним
+# (шлях до файлу для openapi-mcp, каталог для маршрутизатора).
+def current_spec() -> SpecSnapshot:
+    openapi_spec.get()
+    return spec_cache.snapshot
+
+# Фонове оновлення специфікації, запускається з lifespan у main.py.
+async def refresh_loop() -> None:
+    if settings.OPENAPI_REFRESH_INTERVAL > 0:
+        await spec_cache.run(settings.OPENAPI_REFRESH_INTERVAL)
@@ -2,42 +2,869 @@ from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
 from pathlib import Path
+import hashlib
+import json
+import logging
+import math
+import mmap
 import os
+import pickle
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Any, Callable
+
+import numpy as np
+import typer
 
 # ---------------------------------------------------------------------------
 #  У цьому файлі формується найпростіший RAG-ланцюжок. Ми беремо тексти з
 #  каталогу rag_documents, розбиваємо їх на шматочки, будуємо векторний
 #  індекс FAISS та повертаємо retriever, який може шукати релевантні фрагменти.
+#
+#  Індекс зберігається на диску (каталог .faiss_index) разом із маніфестом –
+#  JSON-файлом, де для кожного документа записано хеш вмісту та ідентифікатори
+#  його шматків. Під час старту ми порівнюємо маніфест із файлами на диску і
+#  відправляємо в OpenAI лише ті шматки, що з'явилися або змінилися.
 # ---------------------------------------------------------------------------
 
 _DOCS_DIR = Path(__file__).parent / "rag_documents"
 _INDEX_PATH = Path(__file__).parent / ".faiss_index"
+_MANIFEST_NAME = "manifest.json"
+_MANIFEST_VERSION = 1
 
-# 1) Завантаження документів з диску.
-def _load_docs():
-    docs = []
-    for p in _DOCS_DIR.glob("**/*.txt"):
-        loader = TextLoader(str(p), encoding="utf-8")
-        docs.extend(loader.load())
-    return docs
-
-# 2) Створення або відновлення індексу та повернення retriever'а.
-def build_or_load_retriever():
-    from .config import settings
+# Параметри розбиття записуються в маніфест: якщо вони зміняться, старі
+# шматки вже не відповідатимуть новим і індекс треба перебудувати повністю.
+_CHUNK_SIZE = 1000
+_CHUNK_OVERLAP = 100
 
+def _splitter() -> CharacterTextSplitter:
     # CharacterTextSplitter ділить текст на перекривані шматки,
     # щоб LLM отримував контекст, але не занадто великий.
-    splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    docs = splitter.split_documents(_load_docs())
+    return CharacterTextSplitter(chunk_size=_CHUNK_SIZE, chunk_overlap=_CHUNK_OVERLAP)
+
+def _embeddings() -> OpenAIEmbeddings:
+    from .config import settings
 
     # OpenAIEmbeddings перетворює текст на вектори за допомогою моделі OpenAI.
-    embeddings = OpenAIEmbeddings(api_key=settings.OPENAI_API_KEY)  # використовує OPENAI_API_KEY з env
+    # Для сумісних серверів (OPENAI_BASE_URL) надсилаємо сам текст: попередня
+    # токенізація tiktoken потрібна лише справжньому OpenAI.
+    return OpenAIEmbeddings(
+        api_key=settings.OPENAI_API_KEY,
+        base_url=settings.OPENAI_BASE_URL,
+        check_embedding_ctx_length=settings.OPENAI_BASE_URL is None,
+    )
+
+# === Хешування файлів і шматків ================================================
+# Ключ файлу в маніфесті – шлях відносно rag_documents, щоб індекс не залежав
+# від того, де лежить репозиторій.
+def _scan_docs() -> dict[str, Path]:
+    return {p.relative_to(_DOCS_DIR).as_posix(): p for p in sorted(_DOCS_DIR.glob("**/*.txt"))}
+
+def _file_sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+# Завантаження одного документа з диску та розбиття його на шматки.
+def _split_file(path: Path):
+    return _splitter().split_documents(TextLoader(str(path), encoding="utf-8").load())
+
+# Ідентифікатор шматка = хеш (файл + текст шматка). Однакові шматки в одному
+# файлі отримують порядковий суфікс, щоб ідентифікатори лишалися унікальними.
+def _chunk_ids(rel: str, chunks) -> list[str]:
+    ids, seen = [], {}
+    for chunk in chunks:
+        digest = hashlib.sha256(f"{rel}\0{chunk.page_content}".encode("utf-8")).hexdigest()
+        n = seen.get(digest, 0)
+        seen[digest] = n + 1
+        ids.append(digest if n == 0 else f"{digest}-{n}")
+    return ids
+
+# === Маніфест ==================================================================
+def _new_manifest(embeddings: OpenAIEmbeddings) -> dict:
+    return {
+        "version": _MANIFEST_VERSION,
+        "chunk_size": _CHUNK_SIZE,
+        "chunk_overlap": _CHUNK_OVERLAP,
+        "embedding_model": embeddings.model,
+        "files": {},
+    }
+
+def _read_manifest() -> dict | None:
+    try:
+        with (_INDEX_PATH / _MANIFEST_NAME).open(encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _manifest_compatible(manifest: dict, embeddings: OpenAIEmbeddings) -> bool:
+    expected = _new_manifest(embeddings)
+    return all(manifest.get(k) == expected[k]
+               for k in ("version", "chunk_size", "chunk_overlap", "embedding_model"))
+
+# === Збереження та завантаження індексу ========================================
+# Записуємо індекс у тимчасовий каталог і лише потім підміняємо старий, щоб
+# процес, який впав посеред запису, не залишив напівзаписаний індекс.
+def _save_index(vectorstore: FAISS, manifest: dict) -> None:
+    tmp = _INDEX_PATH.with_name(_INDEX_PATH.name + ".tmp")
+    old = _INDEX_PATH.with_name(_INDEX_PATH.name + ".old")
+    shutil.rmtree(tmp, ignore_errors=True)
+    vectorstore.save_local(str(tmp))
+    with (tmp / _MANIFEST_NAME).open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(old, ignore_errors=True)
+    if _INDEX_PATH.exists():
+        os.replace(_INDEX_PATH, old)
+    os.replace(tmp, _INDEX_PATH)
+    shutil.rmtree(old, ignore_errors=True)
 
-    # Найпростіший варіант – перебудовуємо індекс щоразу в оперативній пам'яті.
-    vectorstore = FAISS.from_documents(docs, embeddings)
+# Формат файлів – той самий, що й у FAISS.save_local: index.faiss з векторами
+# та index.pkl зі сховищем шматків. Pickle тут безпечний, бо файл створює
+# лише цей модуль. Якщо індекс не треба змінювати, відкриваємо його через
+# mmap: ОС підвантажує сторінки з диску за потреби замість копіювання в пам'ять,
+# а процеси, які відкрили той самий файл, ділять ці сторінки.
+# IO_FLAG_MMAP_IFC відображає у пам'ять самі масиви векторів (IndexFlat тощо);
+# старий IO_FLAG_MMAP на IndexFlatL2, який пише LangChain, не діє – вектори
+# мовчки копіюються. Тип індексу, який FAISS не вміє відобразити (або FAISS,
+# старіший за 1.8 без цього прапорця), читаємо в пам'ять.
+def _read_faiss_index(index_path: Path, use_mmap: bool):
+    import faiss
+
+    index_file = str(index_path / "index.faiss")
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if use_mmap and flag is not None:
+        try:
+            return faiss.read_index(index_file, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            logging.info("FAISS index type does not support mmap, reading into memory")
+    elif use_mmap:
+        logging.info("This FAISS version cannot mmap the index, reading into memory")
+    return faiss.read_index(index_file)
+
+def _read_docstore(index_path: Path):
+    with (index_path / "index.pkl").open("rb") as f:
+        return pickle.load(f)
+
+def _load_vectorstore(embeddings: OpenAIEmbeddings, use_mmap: bool) -> FAISS:
+    index = _read_faiss_index(_INDEX_PATH, use_mmap)
+    docstore, index_to_docstore_id = _read_docstore(_INDEX_PATH)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+# === Синхронізація індексу з документами =======================================
+def _full_build(files: dict[str, Path], embeddings: OpenAIEmbeddings) -> FAISS:
+    manifest = _new_manifest(embeddings)
+    docs, ids = [], []
+    for rel, path in files.items():
+        chunks = _split_file(path)
+        chunk_ids = _chunk_ids(rel, chunks)
+        manifest["files"][rel] = {"sha256": _file_sha256(path), "chunks": chunk_ids}
+        docs.extend(chunks)
+        ids.extend(chunk_ids)
+    logging.info(f"Building FAISS index from scratch: {len(docs)} chunks")
+    vectorstore = FAISS.from_documents(docs, embeddings, ids=ids)
+    _save_index(vectorstore, manifest)
+    return vectorstore
+
+def sync_index(rebuild: bool = False) -> FAISS:
+    """Приводить індекс на диску у відповідність до rag_documents і повертає його."""
+    embeddings = _embeddings()
+    files = _scan_docs()
+    manifest = None if rebuild else _read_manifest()
+    if manifest is None or not _manifest_compatible(manifest, embeddings):
+        return _full_build(files, embeddings)
+
+    old_files = manifest["files"]
+    new_files, to_add, to_add_ids, to_delete = {}, [], [], []
+    for rel, path in files.items():
+        sha = _file_sha256(path)
+        old = old_files.get(rel)
+        if old is not None and old["sha256"] == sha:
+            new_files[rel] = old
+            continue
+        # Файл новий або змінився: перерізаємо його і беремо лише ті шматки,
+        # яких ще немає в індексі. Незмінені шматки зберігають свої вектори.
+        chunks = _split_file(path)
+        chunk_ids = _chunk_ids(rel, chunks)
+        old_ids = set(old["chunks"]) if old is not None else set()
+        for chunk, chunk_id in zip(chunks, chunk_ids):
+            if chunk_id not in old_ids:
+                to_add.append(chunk)
+                to_add_ids.append(chunk_id)
+        to_delete.extend(old_ids - set(chunk_ids))
+        new_files[rel] = {"sha256": sha, "chunks": chunk_ids}
+    for rel, old in old_files.items():
+        if rel not in files:
+            to_delete.extend(old["chunks"])
+
+    if not to_add and not to_delete:
+        return _load_vectorstore(embeddings, use_mmap=True)
+
+    logging.info(f"Updating FAISS index: +{len(to_add)} / -{len(to_delete)} chunks")
+    vectorstore = _load_vectorstore(embeddings, use_mmap=False)
+    if to_delete:
+        vectorstore.delete(to_delete)
+    if to_add:
+        vectorstore.add_documents(to_add, ids=to_add_ids)
+    manifest["files"] = new_files
+    _save_index(vectorstore, manifest)
+    return vectorstore
+
+def verify_index() -> list[str]:
+    """Перевіряє індекс без звернень до OpenAI. Повертає список розбіжностей."""
+    manifest = _read_manifest()
+    if manifest is None:
+        return [f"manifest not found in {_INDEX_PATH}"]
+
+    problems = []
+    files = _scan_docs()
+    for rel, path in files.items():
+        entry = manifest["files"].get(rel)
+        if entry is None:
+            problems.append(f"new file not indexed: {rel}")
+        elif entry["sha256"] != _file_sha256(path):
+            problems.append(f"file changed since indexing: {rel}")
+    for rel in manifest["files"].keys() - files.keys():
+        problems.append(f"file removed but still indexed: {rel}")
+
+    index = _read_faiss_index(_INDEX_PATH, use_mmap=True)
+    _, index_to_docstore_id = _read_docstore(_INDEX_PATH)
+    expected_ids = {i for entry in manifest["files"].values() for i in entry["chunks"]}
+    stored_ids = set(index_to_docstore_id.values())
+    if index.ntotal != len(index_to_docstore_id):
+        problems.append(f"vector count {index.ntotal} != docstore size {len(index_to_docstore_id)}")
+    if expected_ids != stored_ids:
+        problems.append(f"chunk ids mismatch: {len(expected_ids - stored_ids)} missing, "
+                        f"{len(stored_ids - expected_ids)} orphaned")
+    return problems
+
+# Створення або відновлення індексу та повернення retriever'а.
+def build_or_load_retriever():
+    vectorstore = sync_index()
     return vectorstore.as_retriever(search_kwargs={"k": 4})
 
+# === Лексичний індекс (BM25) ===================================================
+# Запити на кшталт "X-API-Key" чи "get_user_info_users__user_id__get" точно
+# знаходяться за словами, і для них не варто ходити в OpenAI за ембедингом.
+# Інвертований індекс будуємо з тих самих шматків, що лежать у docstore FAISS,
+# тож обидва пошуки бачать однаковий набір документів.
+_TOKEN_RE = re.compile(r"[\w-]+")
+_PART_RE = re.compile(r"[_-]+|(?<=[a-z0-9])(?=[A-Z])")
+
+# Терміни: слово цілком (x-api-key) і, для складених ідентифікаторів, його
+# частини (x, api, key; getUserInfo -> get, user, info).
+def _terms(text: str) -> list[str]:
+    terms = []
+    for token in _TOKEN_RE.findall(text):
+        whole = token.strip("_-").casefold()
+        if not whole:
+            continue
+        terms.append(whole)
+        parts = [p.casefold() for p in _PART_RE.split(token) if p]
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+class LexicalIndex:
+    # Класичні параметри BM25: насичення частоти терміна та нормування довжини.
+    K1 = 1.2
+    B = 0.75
+
+    # docs – список Document або ChunkStore; тексти не копіюються, індекс
+    # тримає лише постинги та довжини шматків.
+    def __init__(self, docs: Sequence):
+        self.docs = docs
+        self._postings: dict[str, list[tuple[int, int]]] = {}
+        self._lengths = []
+        for i, doc in enumerate(docs):
+            counts: dict[str, int] = {}
+            for term in _terms(doc.page_content):
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                self._postings.setdefault(term, []).append((i, tf))
+            self._lengths.append(sum(counts.values()))
+        n = len(docs)
+        self._avgdl = (sum(self._lengths) / n) if n else 0.0
+        # IDF у варіанті Lucene: завжди додатний, навіть для слів з кожного шматка.
+        self._idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in self._postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    @property
+    def terms(self) -> int:
+        return len(self._postings)
+
+    # Повертає [(номер шматка, оцінка)] за спаданням оцінки.
+    def search(self, query: str, limit: int) -> list[tuple[int, float]]:
+        scores: dict[int, float] = {}
+        for term in set(_terms(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self._postings[term]:
+                norm = self.K1 * (1 - self.B + self.B * self._lengths[i] / self._avgdl)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    # Шматки, які містять запит дослівно (без урахування регістру та пробілів).
+    # Перевіряємо лише тих кандидатів, де є всі терміни запиту.
+    def exact(self, query: str) -> set[int]:
+        phrase = " ".join(query.split()).casefold()
+        terms = set(_terms(query))
+        if not terms or any(t not in self._postings for t in terms):
+            return set()
+        candidates = set.intersection(*({i for i, _ in self._postings[t]} for t in terms))
+        return {i for i in candidates if phrase in " ".join(self.docs[i].page_content.split()).casefold()}
+
+# === Кеш запитів ===============================================================
+# Агент часто повторює той самий пошук – у межах одного kickoff() і між
+# клієнтами. Кешуємо дві речі:
+#   * нормований текст запиту -> вектор ембедингу (ключ також містить модель,
+#     тож зміна моделі, яка перебудовує індекс, робить старі вектори недоступними);
+#   * вектор запиту -> ідентифікатори знайдених шматків. Попаданням вважається
+#     і "сусідній" вектор: косинусна близькість >= RAG_CACHE_SIMILARITY, тож
+#     "Як отримати товар?" та "як отримати товар" дають один результат.
+#     Записи прив'язані до відбитка індексу (хеш моделі та ідентифікаторів
+#     шматків) і скидаються, щойно індекс змінився.
+# Обидва кеші – LRU з TTL. За RAG_CACHE_PERSIST=true вміст зберігається в
+# .rag_cache під час зупинки сервера і підхоплюється після перезапуску.
+_CACHE_PATH = Path(__file__).parent / ".rag_cache" / "query_cache.pkl"
+_CACHE_VERSION = 1
+
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    # accept – необов'язкова перевірка значення: відхилене значення рахується як промах.
+    def get(self, key, accept: Callable[[Any], bool] | None = None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self._data[key]
+                entry = None
+            if entry is None or (accept is not None and not accept(entry[1])):
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, expires_at: float | None = None) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (expires_at or time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    # Позначає запис як щойно використаний, не змінюючи лічильників.
+    def touch(self, key) -> None:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+
+    # Живі записи (key, expires_at, value) від найстаріших до найсвіжіших.
+    def entries(self) -> list[tuple]:
+        now = time.time()
+        with self._lock:
+            return [(k, exp, v) for k, (exp, v) in self._data.items() if exp >= now]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.split()).strip(" ?!.,;:").casefold()
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+class QueryCache:
+    def __init__(self, maxsize: int, ttl: float, similarity: float, path: Path | None):
+        self.embeddings = LRUCache(maxsize, ttl)  # (модель, запит) -> вектор ембедингу
+        self.results = LRUCache(maxsize, ttl)     # (відбиток, запит) -> (одиничний вектор, k, ідентифікатори)
+        self.similarity = similarity
+        self._path = path
+        self._fingerprint: str | None = None
+        self.neighbour_hits = 0
+
+    # Новий індекс: результати для іншого відбитка більше не дійсні – звільняємо місце.
+    def attach(self, fingerprint: str) -> None:
+        if self._fingerprint is None and self._path is not None:
+            self._load(fingerprint)
+        elif self._fingerprint != fingerprint:
+            self.results.clear()
+        self._fingerprint = fingerprint
+
+    def embedding(self, model: str, query: str, embed) -> np.ndarray:
+        vector = self.embeddings.get((model, query))
+        if vector is None:
+            vector = np.asarray(embed(query), dtype=np.float32)
+            self.embeddings.put((model, query), vector)
+        return vector
+
+    # Точний збіг нормованого запиту: ідентифікатори перших k шматків.
+    def lookup(self, fingerprint: str, query: str, k: int) -> list[str] | None:
+        entry = self.results.get((fingerprint, query), accept=lambda value: value[1] >= k)
+        return entry[2][:k] if entry is not None else None
+
+    # Найближчий сусід серед збережених векторів (лише після промаху lookup).
+    def neighbour(self, fingerprint: str, vector: np.ndarray, k: int) -> list[str] | None:
+        if self.similarity >= 1.0:
+            return None
+        vector = _unit(vector)
+        best, best_score = None, self.similarity
+        for key, _, (other, other_k, ids) in self.results.entries():
+            if key[0] == fingerprint and other_k >= k:
+                score = float(np.dot(vector, other))
+                if score >= best_score:
+                    best, best_score = (key, ids), score
+        if best is None:
+            return None
+        self.neighbour_hits += 1
+        self.results.touch(best[0])
+        return best[1][:k]
+
+    def store(self, fingerprint: str, query: str, vector: np.ndarray, k: int, ids: list[str]) -> None:
+        self.results.put((fingerprint, query), (_unit(vector), k, ids))
+
+    def stats(self) -> dict:
+        return {
+            **{f"embedding_{k}": v for k, v in self.embeddings.stats().items()},
+            **{f"result_{k}": v for k, v in self.results.stats().items()},
+            "result_neighbour_hits": self.neighbour_hits,
+        }
+
+    # === Диск ===
+    def _load(self, fingerprint: str) -> None:
+        try:
+            with self._path.open("rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+        if data.get("version") != _CACHE_VERSION:
+            return
+        now = time.time()
+        for key, expires_at, vector in data["embeddings"]:
+            if expires_at >= now:
+                self.embeddings.put(key, vector, expires_at)
+        for key, expires_at, value in data["results"]:
+            if key[0] == fingerprint and expires_at >= now:
+                self.results.put(key, value, expires_at)
+        logging.info(f"Loaded RAG query cache: {len(self.embeddings.entries())} embeddings, "
+                     f"{len(self.results.entries())} results")
+
+    def save(self) -> None:
+        if self._path is None or self._fingerprint is None:
+            return
+        data = {
+            "version": _CACHE_VERSION,
+            "embeddings": self.embeddings.entries(),
+            "results": self.results.entries(),
+        }
+        self._path.parent.mkdir(exist_ok=True)
+        # Кілька робочих процесів можуть зберігати кеш одночасно – у кожного свій тимчасовий файл.
+        tmp = self._path.with_suffix(f".{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path)
+
+_query_cache: QueryCache | None = None
+
+def query_cache() -> QueryCache:
+    global _query_cache
+    if _query_cache is None:
+        from .config import settings
+
+        _query_cache = QueryCache(
+            maxsize=settings.RAG_CACHE_SIZE,
+            ttl=settings.RAG_CACHE_TTL,
+            similarity=settings.RAG_CACHE_SIMILARITY,
+            path=_CACHE_PATH if settings.RAG_CACHE_PERSIST else None,
+        )
+    return _query_cache
+
+# === Кеш відповідей ============================================================
+# Готові відповіді агента на питання, для яких знадобилася лише база знань.
+# Ключ – область (scope: відбиток індексу та версія специфікації, див.
+# crew_runtime) і нормований текст питання. Без точного збігу шукаємо в тій
+# самій області питання з косинусною близькістю ембедингів >= similarity.
+# Що саме можна класти в кеш, вирішує crew_runtime.remember_answer().
+class AnswerCache:
+    def __init__(self, maxsize: int, ttl: float, similarity: float):
+        self.answers = LRUCache(maxsize, ttl)  # (область, питання) -> (одиничний вектор, відповідь)
+        self.similarity = similarity
+        self.neighbour_hits = 0
+        self.stored = 0
+        self.refused = 0  # відповіді, які не можна ділити (інструменти, історія)
+
+    # embed(нормоване_питання) -> вектор; викликається лише без точного збігу.
+    def lookup(self, scope: str, question: str, embed) -> str | None:
+        key = _normalize_query(question)
+        entry = self.answers.get((scope, key))
+        if entry is not None:
+            return entry[1]
+        if self.similarity >= 1.0:
+            return None
+        vector = _unit(embed(key))
+        best, best_score = None, self.similarity
+        for other_key, _, (other, answer) in self.answers.entries():
+            if other_key[0] == scope:
+                score = float(np.dot(vector, other))
+                if score >= best_score:
+                    best, best_score = (other_key, answer), score
+        if best is None:
+            return None
+        self.neighbour_hits += 1
+        self.answers.touch(best[0])
+        return best[1]
+
+    def store(self, scope: str, question: str, embed, answer: str) -> None:
+        key = _normalize_query(question)
+        self.answers.put((scope, key), (_unit(embed(key)), answer))
+        self.stored += 1
+
+    def stats(self) -> dict:
+        return {
+            **self.answers.stats(),
+            "neighbour_hits": self.neighbour_hits,
+            "stored": self.stored,
+            "refused": self.refused,
+        }
+
+# === Гібридний пошук ===========================================================
+# 1. Точний збіг: якщо запит дослівно зустрічається не більше ніж у k шматках,
+#    відповідаємо лише з лексичного індексу – без ембедингу запиту.
+# 2. Інакше беремо кандидатів і з BM25, і з FAISS та зливаємо списки через
+#    reciprocal rank fusion: оцінка шматка = сума 1 / (RAG_RRF_K + ранг).
+#    RRF працює з рангами, тож різні шкали оцінок BM25 та FAISS не заважають.
+class HybridRetriever:
+    # index – індекс FAISS; docs[i] та ids[i] – шматок і його ідентифікатор для
+    # вектора з позицією i. Зазвичай створюється через from_vectorstore().
+    def __init__(self, index, docs: Sequence, ids: list[str], embeddings):
+        from .config import settings
+
+        self._settings = settings
+        self.index = index
+        self.embeddings = embeddings
+        self._ids = ids
+        self._positions = {doc_id: i for i, doc_id in enumerate(ids)}
+        self._docs = docs
+        self.lexical = LexicalIndex(docs)
+        self._model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.fingerprint = hashlib.sha256("\0".join([self._model, *self._ids]).encode("utf-8")).hexdigest()[:16]
+        self._cache = query_cache()
+        self._cache.attach(self.fingerprint)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore: FAISS) -> "HybridRetriever":
+        mapping = vectorstore.index_to_docstore_id
+        ids = [mapping[i] for i in range(len(mapping))]
+        docs = [vectorstore.docstore.search(doc_id) for doc_id in ids]
+        return cls(vectorstore.index, docs, ids, vectorstore.embedding_function)
+
+    def _k(self, k: int | None) -> int:
+        return max(1, min(k or self._settings.RAG_TOP_K, self._settings.RAG_CANDIDATES))
+
+    # Повертає шматки та шлях, яким їх знайдено: "exact", "cache" або "hybrid".
+    def search(self, query: str, k: int | None = None) -> tuple[list, str]:
+        k = self._k(k)
+        candidates = max(k, self._settings.RAG_CANDIDATES)
+        lexical = self.lexical.search(query, candidates)
+
+        exact = self.lexical.exact(query)
+        if exact and len(exact) <= k:
+            # Спершу дослівні збіги, решту місць добираємо з BM25.
+            ranked = [i for i, _ in lexical if i in exact] + [i for i, _ in lexical if i not in exact]
+            return [self._docs[i] for i in ranked[:k]], "exact"
+
+        key = _normalize_query(query)
+        embedding = None
+        ids = self._cache.lookup(self.fingerprint, key, k)
+        if ids is None:
+            embedding = self._cache.embedding(self._model, key, self.embeddings.embed_query)
+            ids = self._cache.neighbour(self.fingerprint, embedding, k)
+        if ids is not None and all(doc_id in self._positions for doc_id in ids):
+            return [self._docs[self._positions[doc_id]] for doc_id in ids], "cache"
+        if embedding is None:
+            embedding = self._cache.embedding(self._model, key, self.embeddings.embed_query)
+
+        _, positions = self.index.search(embedding.reshape(1, -1), candidates)
+        vector = [int(i) for i in positions[0] if i >= 0]
+        fused: dict[int, float] = {}
+        for ranking in ([i for i, _ in lexical], vector):
+            for rank, i in enumerate(ranking, start=1):
+                fused[i] = fused.get(i, 0.0) + 1.0 / (self._settings.RAG_RRF_K + rank)
+        ranked = sorted(fused, key=lambda i: (-fused[i], i))[:k]
+        self._cache.store(self.fingerprint, key, embedding, k, [self._ids[i] for i in ranked])
+        return [self._docs[i] for i in ranked], "hybrid"
+
+    # Вектор запиту через кеш ембедингів (для кешу відповідей у crew_runtime).
+    def embed(self, query: str) -> np.ndarray:
+        return self._cache.embedding(self._model, _normalize_query(query), self.embeddings.embed_query)
+
+    def stats(self) -> dict:
+        return {"chunks": len(self.lexical), "terms": self.lexical.terms, **self._cache.stats()}
+
+# === Спільний індекс для кількох процесів ======================================
+# З uvicorn --workers N кожен процес будував би індекс сам і тримав власну
+# копію векторів. У режимі RAG_SHARED_INDEX індекс готує окремий процес-
+# будівник (python -m mcp_server.rag publish --watch 30): він синхронізує
+# .faiss_index з документами і публікує незмінне покоління
+#   .rag_shared/gen-000042/index.faiss  – вектори FAISS
+#                          chunks.bin   – шматки (JSON-записи підряд)
+#                          offsets.npy  – зміщення записів у chunks.bin
+#                          meta.json    – модель ембедингів та ідентифікатори шматків
+# після чого атомарно переписує вказівник .rag_shared/CURRENT. Робочі процеси
+# лише читають: відкривають поточне покоління через mmap (сторінки векторів і
+# шматків у пам'яті спільні для всіх процесів) і раз на RAG_RELOAD_INTERVAL
+# секунд перевіряють CURRENT. Нове покоління підхоплюється підміною об'єкта;
+# запити, які вже почали пошук, дочитують старе – його файли лишаються
+# відкритими, навіть якщо будівник уже видалив каталог.
+_SHARED_PATH = Path(__file__).parent / ".rag_shared"
+_CURRENT_NAME = "CURRENT"
+_KEEP_GENERATIONS = 2
+
+def _generation_number(name: str) -> int:
+    return int(name.removeprefix("gen-"))
+
+def _generations(root: Path) -> list[Path]:
+    return sorted((p for p in root.glob("gen-*") if p.is_dir() and p.name[4:].isdigit()),
+                  key=lambda p: _generation_number(p.name))
+
+def _read_current(root: Path) -> str | None:
+    try:
+        return (root / _CURRENT_NAME).read_text(encoding="utf-8").strip() or None
+    except OSError:
+        return None
+
+# Сховище шматків, яке читається через mmap: запис i лежить у chunks.bin між
+# offsets[i] та offsets[i + 1] і розбирається лише тоді, коли він потрібен.
+class ChunkStore(Sequence):
+    def __init__(self, path: Path, ids: list[str]):
+        self._ids = ids
+        self._offsets = np.load(path / "offsets.npy", mmap_mode="r")
+        with (path / "chunks.bin").open("rb") as f:
+            # Порожній файл не можна відобразити в пам'ять.
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets[-1] else b""
+
+    @staticmethod
+    def write(path: Path, docs: list) -> None:
+        offsets = [0]
+        with (path / "chunks.bin").open("wb") as f:
+            for doc in docs:
+                record = json.dumps({"text": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False)
+                offsets.append(offsets[-1] + f.write(record.encode("utf-8")))
+        np.save(path / "offsets.npy", np.array(offsets, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = range(len(self))[i]
+        record = json.loads(self._data[int(self._offsets[i]):int(self._offsets[i + 1])])
+        return Document(page_content=record["text"], metadata=record["metadata"], id=self._ids[i])
+
+# Публікує поточний стан .faiss_index як нове покоління. Повертає його каталог.
+def publish_generation(vectorstore: FAISS, root: Path = _SHARED_PATH) -> Path:
+    import faiss
+
+    root.mkdir(exist_ok=True)
+    existing = _generations(root)
+    name = f"gen-{(_generation_number(existing[-1].name) + 1) if existing else 1:06d}"
+    tmp = root / (name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+
+    mapping = vectorstore.index_to_docstore_id
+    ids = [mapping[i] for i in range(len(mapping))]
+    faiss.write_index(vectorstore.index, str(tmp / "index.faiss"))
+    ChunkStore.write(tmp, [vectorstore.docstore.search(doc_id) for doc_id in ids])
+    meta = {"embedding_model": vectorstore.embedding_function.model, "ids": ids, "created_at": time.time()}
+    (tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, root / name)
+
+    pointer = root / (_CURRENT_NAME + ".tmp")
+    pointer.write_text(name, encoding="utf-8")
+    os.replace(pointer, root / _CURRENT_NAME)
+    for old in _generations(root)[:-_KEEP_GENERATIONS]:
+        shutil.rmtree(old, ignore_errors=True)
+    logging.info(f"Published RAG index generation {name}: {len(ids)} chunks")
+    return root / name
+
+def _published_ids(root: Path) -> list[str] | None:
+    name = _read_current(root)
+    try:
+        with (root / name / "meta.json").open(encoding="utf-8") as f:
+            return json.load(f)["ids"]
+    except (TypeError, OSError, ValueError, KeyError):
+        return None
+
+# Робочий процес: поточне покоління спільного індексу та фонова перевірка
+# вказівника CURRENT. Має той самий інтерфейс search()/stats(), що й
+# HybridRetriever, тож інструмент RAG Search не знає, який режим увімкнено.
+class SharedIndex:
+    def __init__(self, root: Path):
+        self._root = root
+        self._lock = threading.Lock()
+        self._current: HybridRetriever | None = None
+        self._name: str | None = None
+        self._watcher: threading.Thread | None = None
+        self._stats = {"reloads": 0, "reload_errors": 0}
+
+    def _open(self, name: str) -> HybridRetriever:
+        path = self._root / name
+        with (path / "meta.json").open(encoding="utf-8") as f:
+            meta = json.load(f)
+        embeddings = _embeddings()
+        if meta["embedding_model"] != embeddings.model:
+            raise RuntimeError(f"{name} was embedded with {meta['embedding_model']}, not {embeddings.model}")
+        index = _read_faiss_index(path, use_mmap=True)
+        return HybridRetriever(index, ChunkStore(path, meta["ids"]), meta["ids"], embeddings)
+
+    # Для LazyComponent: відкриває поточне покоління і запускає спостерігача.
+    def load(self) -> "SharedIndex":
+        if self._current is None:
+            name = _read_current(self._root)
+            if name is None:
+                raise RuntimeError(f"no published RAG index in {self._root}; run `python -m mcp_server.rag publish`")
+            current = self._open(name)
+            with self._lock:
+                self._current, self._name = current, name
+            logging.info(f"Opened shared RAG index {name}")
+        self._start_watcher()
+        return self
+
+    # Повертає True, якщо підхопили нове покоління.
+    def reload_if_changed(self) -> bool:
+        name = _read_current(self._root)
+        if name is None or name == self._name:
+            return False
+        current = self._open(name)
+        with self._lock:
+            self._current, self._name = current, name
+        self._stats["reloads"] += 1
+        logging.info(f"Reloaded shared RAG index {name}")
+        return True
+
+    def _start_watcher(self) -> None:
+        from .config import settings
+
+        with self._lock:
+            if self._watcher is not None or settings.RAG_RELOAD_INTERVAL <= 0:
+                return
+            self._watcher = threading.Thread(
+                target=self._watch, args=(settings.RAG_RELOAD_INTERVAL,), name="rag-index-watcher", daemon=True
+            )
+            self._watcher.start()
+
+    def _watch(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload_if_changed()
+            except Exception:
+                self._stats["reload_errors"] += 1
+                logging.exception("Shared RAG index reload failed; keeping the current generation")
+
+    def search(self, query: str, k: int | None = None) -> tuple[list, str]:
+        return self._current.search(query, k)
+
+    @property
+    def fingerprint(self) -> str:
+        return self._current.fingerprint
+
+    def embed(self, query: str) -> np.ndarray:
+        return self._current.embed(query)
+
+    def stats(self) -> dict:
+        stats = {**self._current.stats(), **self._stats} if self._current else dict(self._stats)
+        stats["generation"] = _generation_number(self._name) if self._name else 0
+        return stats
+
+shared_index = SharedIndex(_SHARED_PATH)
+
+# Retriever для сервера: власний індекс процесу або, у режимі
+# RAG_SHARED_INDEX, поточне покоління від будівника.
+def build_or_load_hybrid_retriever() -> HybridRetriever | SharedIndex:
+    from .config import settings
+
+    if settings.RAG_SHARED_INDEX:
+        return shared_index.load()
+    return HybridRetriever.from_vectorstore(sync_index())
+
+# === CLI =======================================================================
+# Дозволяє обслуговувати індекс офлайн, не піднімаючи сервер:
+#   python -m mcp_server.rag sync      – доембедити лише змінені шматки
+#   python -m mcp_server.rag rebuild   – перебудувати індекс з нуля
+#   python -m mcp_server.rag verify    – звірити індекс з документами
+#   python -m mcp_server.rag search Q  – гібридний пошук, як у інструменті RAG Search
+#   python -m mcp_server.rag publish   – опублікувати покоління для RAG_SHARED_INDEX
+#                                        (--watch N: перевіряти документи кожні N секунд)
+cli = typer.Typer(help="Обслуговування FAISS-індексу бази знань.")
+
+@cli.command()
+def sync():
+    vectorstore = sync_index()
+    typer.echo(f"Index is up to date: {vectorstore.index.ntotal} vectors")
+
+@cli.command()
+def rebuild():
+    vectorstore = sync_index(rebuild=True)
+    typer.echo(f"Index rebuilt: {vectorstore.index.ntotal} vectors")
+
+@cli.command()
+def publish(watch: float = typer.Option(0.0, help="Перевіряти документи кожні N секунд і публікувати зміни.")):
+    while True:
+        vectorstore = sync_index()
+        mapping = vectorstore.index_to_docstore_id
+        if _published_ids(_SHARED_PATH) != [mapping[i] for i in range(len(mapping))]:
+            path = publish_generation(vectorstore)
+            typer.echo(f"Published {path.name}: {vectorstore.index.ntotal} vectors")
+        if watch <= 0:
+            return
+        time.sleep(watch)
+
+@cli.command()
+def search(query: str, k: int = typer.Option(4, help="Скільки шматків повернути.")):
+    docs, path = build_or_load_hybrid_retriever().search(query, k)
+    typer.echo(f"{len(docs)} chunks via {path} search")
+    for i, doc in enumerate(docs, start=1):
+        typer.echo(f"[{i}] {doc.page_content}\n")
+
+@cli.command()
+def verify():
+    problems = verify_index()
+    for problem in problems:
+        typer.echo(problem, err=True)
+    if problems:
+        raise typer.Exit(code=1)
+    typer.echo("Index is consistent with rag_documents")
+
 # ---------------------------------------------------------------------------
 #  Альтернативний приклад (закоментовано): як перейти на Chroma або інший
 #  постійний Vector DB збереженням індексу на диску.
@@ -49,3 +876,6 @@ def build_or_load_retriever():
 #     embeddings = OpenAIEmbeddings()
 #     vectordb = Chroma.from_documents(docs, embeddings, persist_directory=str(_INDEX_PATH))
 #     return vectordb.as_retriever(search_kwargs={"k": 4})
+
+if __name__ == "__main__":
+    cli()
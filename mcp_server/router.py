@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import quote
+
+import httpx
+
+from . import api_proxy
+from .config import settings
+from .openapi_catalog import current_spec, openapi_spec
+
+# ---------------------------------------------------------------------------
+#  Швидкий детермінований маршрутизатор. Багато запитів – це прямий пошук
+#  однієї сутності ("Покажи користувача user123", "item_abc"), який
+#  відповідає рівно одній операції OpenAPI (/users/{user_id},
+#  /items/{item_id}). Для них не потрібен агент CrewAI з кількома викликами
+#  LLM: ми розпізнаємо ідентифікатор за шаблоном, складеним із параметрів
+#  шляху специфікації, напряму викликаємо Dummy API з ключем клієнта і
+#  формуємо відповідь за шаблоном. Усе інше йде до повноцінного агента.
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class Route:
+    tool: str            # operationId – те саме ім'я, що й у MCP-інструмента
+    path: str            # /users/{user_id}
+    param: str           # user_id
+    entity: str          # user
+    nouns: tuple[str, ...]  # назви сутності зі специфікації: user, users (з тегу Users)
+    pattern: re.Pattern
+    response: str | None  # ім'я схеми відповіді, напр. UserInfo
+
+@dataclass
+class RoutedAnswer:
+    tool: str
+    args: dict[str, str]
+    text: str
+
+# === Шаблони відповідей ========================================================
+# Ключ – ім'я схеми відповіді з OpenAPI. Для невідомих схем використовується
+# загальний шаблон "поле: значення".
+TEMPLATES = {
+    "UserInfo": "Користувач {user_id}: ім'я – {username}, ролі – {roles}.",
+    "Item": "Товар {item_id}: {name}. Опис: {description}.",
+}
+NOT_FOUND = "За ідентифікатором {value} нічого не знайдено."
+
+def _fmt(value: Any) -> str:
+    if value is None:
+        return "—"
+    if isinstance(value, list):
+        return ", ".join(_fmt(v) for v in value)
+    return str(value)
+
+def render(route: Route, data: dict) -> str:
+    values = {k: _fmt(v) for k, v in data.items()}
+    template = TEMPLATES.get(route.response or "")
+    if template is not None:
+        try:
+            return template.format(**values)
+        except KeyError:
+            pass  # схема змінилася – падаємо на загальний шаблон
+    lines = [f"{route.entity} {values.get(route.param, '')}:"]
+    lines += [f"- {k}: {v}" for k, v in values.items() if k != route.param]
+    return "\n".join(lines)
+
+# === Компіляція маршрутів зі специфікації ======================================
+# Придатні операції: GET з рівно одним параметром шляху вигляду <entity>_id і
+# без обов'язкових query-параметрів. Ідентифікатор має починатися з назви
+# сутності й далі містити цифру або роздільник: user123, item_abc, user-7.
+# Назви сутності для розпізнавання наміру беремо з тієї ж операції: сама
+# сутність, її множина та однослівні теги ("Users").
+def compile_routes(catalog: list[dict]) -> list[Route]:
+    routes = []
+    for op in catalog:
+        if op["method"] != "GET" or len(op["path_params"]) != 1 or op["required_query"]:
+            continue
+        param = op["path_params"][0]
+        if not param.endswith("_id"):
+            continue
+        entity = param[: -len("_id")]
+        nouns = {entity, entity + "s", *(t.lower() for t in op.get("tags", ()))}
+        pattern = re.compile(
+            rf"(?<![\w-])({re.escape(entity)}(?:\d[\w-]*|[_-][a-z0-9][\w-]*))(?![\w-])",
+            re.IGNORECASE,
+        )
+        routes.append(Route(op["tool"], op["path"], param, entity, tuple(sorted(nouns)), pattern, op.get("response")))
+    return routes
+
+_compiled: tuple[int, list[Route]] | None = None
+
+def _routes() -> list[Route]:
+    # Маршрути перекомпільовуються лише тоді, коли змінилася специфікація.
+    global _compiled
+    spec = current_spec()
+    compiled = _compiled
+    if compiled is None or compiled[0] != spec.generation:
+        compiled = _compiled = (spec.generation, compile_routes(spec.catalog))
+    return compiled[1]
+
+# === Розпізнавання наміру ======================================================
+# Ідентифікатор у тексті ще не означає пошук: "Що таке user_roles?" чи "Як
+# отримати user123 через curl?" – питання до агента. Швидким шляхом ідемо,
+# лише коли запит – це голий ідентифікатор або "дієслово пошуку + назва
+# сутності + ідентифікатор": "Покажи користувача user123", "знайди товар
+# item_abc", "дай інформацію про user7". Після ідентифікатора – лише
+# розділові знаки. Українські слова порівнюємо за основою, щоб не перелічувати
+# відмінки, англійські – цілком.
+# Англійські назви сутностей беруться зі специфікації (Route.nouns), а от
+# українських у ній немає: основи в _ENTITY_NOUNS задано вручну для сутностей
+# Dummy API. Нова сутність без запису тут працює швидким шляхом як голий
+# ідентифікатор або з англійською назвою ("show user user123"), а
+# "покажи <українська назва> ..." для неї йде до агента.
+_LOOKUP_VERBS = ("покаж", "показ", "знайд", "знайт", "дай", "дайте", "виведи", "виведіть", "отримай", "отримайте")
+_FILLERS = ("мені", "будь", "ласка", "інформаці", "інфо", "дані", "про")
+_ENTITY_NOUNS = {"user": ("користувач", "юзер"), "item": ("товар", "предмет")}
+_ENGLISH_VERBS = {"show", "find", "get", "lookup"}
+_ENGLISH_FILLERS = {"me", "please", "info", "about"}
+_WORD_RE = re.compile(r"[\w'’-]+")
+
+def _is_lookup(prefix: str, route: Route) -> bool:
+    words = [w.lower() for w in _WORD_RE.findall(prefix)]
+    if not words:
+        return True  # голий ідентифікатор
+    stems = _ENTITY_NOUNS.get(route.entity, ())
+
+    def verb(w: str) -> bool:
+        return w in _ENGLISH_VERBS or w.startswith(_LOOKUP_VERBS)
+
+    def noun(w: str) -> bool:
+        return w in route.nouns or w.startswith(stems)
+
+    def filler(w: str) -> bool:
+        return w in _ENGLISH_FILLERS or w.startswith(_FILLERS)
+
+    # Починається з дієслова пошуку або назви сутності, далі – лише ці слова та "будь ласка", "про" тощо.
+    return (verb(words[0]) or noun(words[0])) and all(verb(w) or noun(w) or filler(w) for w in words)
+
+# Повертає (маршрут, ідентифікатор, голий_ідентифікатор), якщо запит – це
+# короткий прямий пошук рівно однієї сутності. Довгі запити, запити з кількома
+# ідентифікаторами чи з іншим наміром потребують міркувань – їх залишаємо агенту.
+def match(message: str, routes: list[Route]) -> tuple[Route, str, bool] | None:
+    if len(message.split()) > settings.ROUTER_MAX_WORDS:
+        return None
+    found = []
+    for route in routes:
+        for m in route.pattern.finditer(message):
+            if m.group(1).lower() != route.param:
+                found.append((route, m))
+    if len(found) != 1:
+        return None
+    route, m = found[0]
+    prefix, suffix = message[: m.start(1)], message[m.end(1):]
+    if suffix.strip(" \t\n.,!?;:") or not _is_lookup(prefix, route):
+        return None
+    return route, m.group(1), not _WORD_RE.search(prefix)
+
+# === Виконання =================================================================
+# Dummy API викликаємо через кеш проксі (api_proxy): ті самі сутності, які
+# щойно читали інструменти агента, беруться з кешу за ключем клієнта.
+_stats = {"considered": 0, "hits": 0, "misses": 0, "fallbacks": 0}
+
+async def try_route(message: str, client_api_key: str) -> RoutedAnswer | None:
+    """Відповідає на запит без агента або повертає None, якщо запит не підходить."""
+    _stats["considered"] += 1
+    try:
+        routes = _routes() if openapi_spec.ready else await asyncio.to_thread(_routes)
+    except Exception:
+        _stats["misses"] += 1
+        return None
+    matched = match(message, routes)
+    if matched is None:
+        _stats["misses"] += 1
+        return None
+
+    route, value, bare = matched
+    url = route.path.replace("{" + route.param + "}", quote(value, safe=""))
+    try:
+        resp, _ = await api_proxy.proxy.fetch("GET", url, client_api_key)
+    except httpx.HTTPError:
+        logging.warning(f"Fast path {route.tool} failed, falling back to agent", exc_info=True)
+        _stats["fallbacks"] += 1
+        return None
+    if resp.status_code == 404 and bare:
+        text = NOT_FOUND.format(value=value)
+    elif resp.status_code == 200:
+        text = render(route, resp.json())
+    else:
+        # 401/403/5xx тощо: агент принаймні пояснить помилку людською мовою.
+        # 404 на запит зі словами ("покажи користувача user_x") – теж агенту:
+        # можливо, це не ідентифікатор, а агент зрозуміє, що мали на увазі.
+        _stats["fallbacks"] += 1
+        return None
+    _stats["hits"] += 1
+    return RoutedAnswer(tool=route.tool, args={route.param: value}, text=text)
+
+def stats() -> dict:
+    considered = _stats["considered"]
+    return {**_stats, "hit_rate": _stats["hits"] / considered if considered else 0.0}
@@ -0,0 +1,239 @@
+import asyncio
+import contextvars
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+# ---------------------------------------------------------------------------
+#  Планувальник запусків агента. Раніше кожен запит чату відправлявся у
+#  спільний пул потоків asyncio без жодних обмежень: один клієнт міг зайняти
+#  всі потоки, черга росла безмежно, а після розриву з'єднання агент
+#  продовжував працювати й витрачати токени LLM.
+#
+#  Тепер:
+#    * агенти виконуються у власному пулі з AGENT_WORKERS потоків;
+#    * один клієнт може мати не більше AGENT_MAX_PER_CLIENT запусків
+#      (активних та в черзі), а в черзі очікування – не більше
+#      AGENT_QUEUE_SIZE запитів; понад це запит відхиляється (HTTP 429 з
+#      заголовком Retry-After);
+#    * кожен запуск має дедлайн AGENT_RUN_DEADLINE секунд;
+#    * скасування кооперативне: запуск отримує CancelToken і сам перевіряє
+#      його між кроками агента, а зареєстровані обробники (наприклад,
+#      зупинка MCP-сесії) спрацьовують одразу в момент скасування.
+# ---------------------------------------------------------------------------
+
+class SchedulerBusy(Exception):
+    """Запит не прийнято: перевищено ліміт клієнта або черга заповнена."""
+
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+# Як і asyncio.CancelledError, успадковуємося від BaseException: CrewAI
+# перехоплює Exception і повторює задачу, а скасований запуск має завершитися
+# одразу, а не перезапускатися.
+class RunCancelled(BaseException):
+    """Запуск агента скасовано (клієнт відключився або вичерпано дедлайн)."""
+
+# === Токен скасування ==========================================================
+class CancelToken:
+    def __init__(self, deadline: float | None = None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: dict[int, Callable[[], None]] = {}
+        self._next_handle = 0
+        # Утримується, поки виконується обробник: зняття реєстрації чекає на
+        # обробник, що вже почав працювати.
+        self._running = threading.RLock()
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.reason: str | None = None
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline exceeded")
+        return self._event.is_set()
+
+    def remaining(self) -> float | None:
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            pending = bool(self._callbacks)
+        # Обробники можуть блокуватися (зупинка процесу MCP), тому не
+        # виконуємо їх у потоці, який скасовує, – це часто цикл подій сервера.
+        if pending:
+            threading.Thread(target=self._run_pending, daemon=True).start()
+
+    # Повертає функцію, що знімає реєстрацію: після її повернення дію вже не
+    # буде виконано (а якщо вона саме виконується – дочекаємося кінця). Так
+    # пізнє скасування не зачепить ресурс, який запуск уже віддав (MCP-сесію в пулі).
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Реєструє дію, яку треба виконати під час скасування."""
+        with self._lock:
+            if not self._event.is_set():
+                handle = self._next_handle
+                self._next_handle += 1
+                self._callbacks[handle] = callback
+                return lambda: self._unregister(handle)
+        self._run_callbacks([callback])
+        return lambda: None
+
+    def _unregister(self, handle: int) -> None:
+        with self._running, self._lock:
+            self._callbacks.pop(handle, None)
+
+    def _run_pending(self) -> None:
+        while True:
+            with self._running:
+                with self._lock:
+                    if not self._callbacks:
+                        return
+                    callback = self._callbacks.pop(next(iter(self._callbacks)))
+                self._run_callbacks([callback])
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise RunCancelled(self.reason)
+
+    @staticmethod
+    def _run_callbacks(callbacks: list[Callable[[], None]]) -> None:
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logging.exception("Cancel callback failed")
+
+# Оцінка тривалості запуску для Retry-After, поки жоден запуск не завершився:
+# невелика, щоб перший відхилений клієнт не чекав вигадані десятки секунд.
+_FIRST_RUN_ESTIMATE = 2.0
+
+# === Планувальник ==============================================================
+# Увесь облік (лічильники, семафор) змінюється лише в циклі подій, тому
+# додаткові блокування не потрібні: колбеки asyncio-ф'ючерсів теж
+# виконуються в циклі подій.
+class AgentScheduler:
+    def __init__(self, workers: int = 4, per_client: int = 2, max_queue: int = 16, deadline: float | None = 120.0):
+        self.workers = workers
+        self.per_client = per_client
+        self.max_queue = max_queue
+        self.deadline = deadline
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent-run")
+        self._slots: asyncio.Semaphore | None = None
+        self._running = 0
+        self._waiting = 0
+        self._clients: dict[str, int] = {}
+        # Експоненційне ковзне середнє тривалості запуску – для оцінки Retry-After.
+        # None – ще жоден запуск не завершився (див. _FIRST_RUN_ESTIMATE).
+        self._avg_run_seconds: float | None = None
+        self._stats = {
+            "admitted": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+        }
+
+    def new_token(self) -> CancelToken:
+        return CancelToken(self.deadline)
+
+    def submit(self, client_id: str, token: CancelToken, fn: Callable[..., Any], *args: Any) -> asyncio.Task:
+        """Приймає запуск або одразу кидає SchedulerBusy. Повертає asyncio.Task з результатом fn."""
+        if self._clients.get(client_id, 0) >= self.per_client:
+            self._reject(f"too many concurrent requests for client {client_id}")
+        if self._running + self._waiting >= self.workers + self.max_queue:
+            self._reject("agent run queue is full")
+        self._clients[client_id] = self._clients.get(client_id, 0) + 1
+        self._waiting += 1
+        self._stats["admitted"] += 1
+        return asyncio.ensure_future(self._run(client_id, token, fn, args))
+
+    def _reject(self, detail: str) -> None:
+        self._stats["rejected"] += 1
+        queued_rounds = (self._waiting + 1) / self.workers
+        avg = self._avg_run_seconds if self._avg_run_seconds is not None else _FIRST_RUN_ESTIMATE
+        raise SchedulerBusy(detail, retry_after=max(1, math.ceil(avg * queued_rounds)))
+
+    async def _run(self, client_id: str, token: CancelToken, fn: Callable[..., Any], args: tuple) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        # 1) Чекаємо на вільний потік, але не довше за дедлайн запуску.
+        try:
+            await asyncio.wait_for(self._slots.acquire(), token.remaining())
+        except BaseException as e:
+            self._waiting -= 1
+            self._leave(client_id)
+            self._stats["cancelled"] += 1
+            if isinstance(e, asyncio.TimeoutError):
+                token.cancel("deadline exceeded while queued")
+                raise RunCancelled(token.reason) from None
+            token.cancel("client disconnected")
+            raise
+        self._waiting -= 1
+        self._running += 1
+
+        # 2) Виконуємо fn у пулі планувальника. Слот звільняється тоді, коли
+        #    потік справді завершився, а не коли ми перестали чекати на нього:
+        #    інакше скасовані, але ще працюючі агенти перевищили б ліміт.
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        ctx = contextvars.copy_context()
+        future = loop.run_in_executor(self._executor, ctx.run, fn, *args)
+        future.add_done_callback(lambda f: self._finished(client_id, started, token, f))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), token.remaining())
+        except asyncio.TimeoutError:
+            token.cancel("deadline exceeded")
+            raise RunCancelled(token.reason) from None
+        except asyncio.CancelledError:
+            token.cancel("client disconnected")
+            raise
+
+    def _finished(self, client_id: str, started: float, token: CancelToken, future: asyncio.Future) -> None:
+        self._running -= 1
+        self._leave(client_id)
+        self._slots.release()
+        elapsed = time.monotonic() - started
+        if self._avg_run_seconds is None:
+            self._avg_run_seconds = elapsed
+        else:
+            self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * elapsed
+        # Забираємо виняток, навіть якщо на результат уже ніхто не чекає.
+        exc = None if future.cancelled() else future.exception()
+        # Скасування визначаємо за токеном: після дедлайну викликач уже отримав
+        # RunCancelled, а потік міг завершитися як завгодно (успіхом, іншою помилкою).
+        if isinstance(exc, RunCancelled) or token.cancelled:
+            self._stats["cancelled"] += 1
+        elif exc is not None:
+            self._stats["failed"] += 1
+        else:
+            self._stats["completed"] += 1
+
+    def _leave(self, client_id: str) -> None:
+        left = self._clients[client_id] - 1
+        if left:
+            self._clients[client_id] = left
+        else:
+            del self._clients[client_id]
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "running": self._running,
+            "waiting": self._waiting,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "avg_run_seconds": round(self._avg_run_seconds or 0.0, 3),
+        }
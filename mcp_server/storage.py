@@ -1,19 +1,68 @@
+import atexit
+import logging
+import queue
 import sqlite3
+import threading
+import time
 from pathlib import Path
 from typing import Iterable, Tuple
 
+from . import metrics
+from .config import settings
+
 # ---------------------------------------------------------------------------
 #  Просте сховище історії повідомлень на SQLite. Ми зберігаємо кожне
 #  повідомлення (роль + текст) разом із client_id. Це дозволяє відновлювати
 #  контекст діалогу при наступних запитах.
+#
+#  Щоб сховище витримувало багато паралельних чатів:
+#    * з'єднання не відкриваються заново на кожен виклик – кожен потік
+#      тримає власне з'єднання з налаштованими PRAGMA (WAL, кеш, mmap);
+#    * індекс (client_id, id) дозволяє читати історію клієнта без повного
+#      перегляду таблиці;
+#    * записи йдуть через чергу у фоновий потік, який об'єднує повідомлення
+#      з багатьох запитів в одну транзакцію;
+#    * для кожного клієнта зберігається не більше HISTORY_MAX_MESSAGES
+#      останніх повідомлень, старіші видаляються під час запису – але лише
+#      ті, що вже враховані в підсумку розмови;
+#    * раз на HISTORY_COMPACT_INTERVAL секунд записувач ущільнює базу
+#      (compact): WAL не росте безмежно, а статистика запитів актуальна;
+#    * поруч з історією лежить накопичувальний підсумок розмови (таблиця
+#      summaries) – його оновлює context.py, коли старі повідомлення вже не
+#      вміщуються в бюджет токенів.
 # ---------------------------------------------------------------------------
 
 # Шлях до файлу бази даних: лежить поруч із цим модулем.
 _DB = Path(__file__).parent / "chat.db"
 
-# Під час імпорту модуля створюємо таблицю, якщо її ще немає.
+# Скільки повідомлень фоновий потік максимально об'єднує в одну транзакцію.
+_BATCH_MAX = 256
+
+# === З'єднання ================================================================
+# sqlite3-з'єднання не можна ділити між потоками, тому кожен потік (робочі
+# потоки asyncio.to_thread, фоновий записувач) отримує своє і використовує його
+# повторно. WAL дозволяє читачам працювати паралельно з записувачем.
+_local = threading.local()
+
+def _connect() -> sqlite3.Connection:
+    con = sqlite3.connect(_DB, timeout=30)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")   # у режимі WAL це безпечно і значно швидше
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA cache_size=-16000")    # ~16 МБ сторінкового кешу
+    con.execute("PRAGMA mmap_size=268435456")  # читаємо базу через mmap (до 256 МБ)
+    con.execute("PRAGMA busy_timeout=5000")
+    return con
+
+def _conn() -> sqlite3.Connection:
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = _local.con = _connect()
+    return con
+
+# Під час імпорту модуля створюємо таблицю та індекс, якщо їх ще немає.
 def _init():
-    with sqlite3.connect(_DB) as con:
+    with _connect() as con:
         con.execute("""
         CREATE TABLE IF NOT EXISTS messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -22,20 +71,196 @@ def _init():
             content TEXT NOT NULL,
             ts DATETIME DEFAULT CURRENT_TIMESTAMP
         )""")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_messages_client_id ON messages(client_id, id)")
+        con.execute("""
+        CREATE TABLE IF NOT EXISTS summaries (
+            client_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            upto_id INTEGER NOT NULL,  -- останнє повідомлення, яке вже враховано в підсумку
+            ts DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""")
 _init()
 
-# Додаємо нове повідомлення у базу.
+# === Фоновий записувач ========================================================
+# add() лише кладе повідомлення в чергу і одразу повертається. Фоновий потік
+# забирає з черги все, що накопичилося, і записує однією транзакцією, а потім
+# застосовує політику зберігання до клієнтів, яких торкнувся запис. Коли
+# настає час ущільнення, записувач прокидається сам, навіть без нових записів.
+class _Writer:
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue()
+        self._pending: dict[str, int] = {}
+        self._cond = threading.Condition()
+        self._next_compaction = time.monotonic() + settings.HISTORY_COMPACT_INTERVAL
+        self._thread = threading.Thread(target=self._run, name="chat-history-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, client_id: str, messages: list[Tuple[str, str]]) -> None:
+        with self._cond:
+            self._pending[client_id] = self._pending.get(client_id, 0) + 1
+        self._queue.put((client_id, messages))
+
+    def flush(self, client_id: str | None = None, timeout: float | None = 10.0) -> bool:
+        """Чекає, поки записи клієнта (або всі записи) потраплять у базу."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not (self._pending.get(client_id) if client_id else self._pending),
+                timeout,
+            )
+
+    def _until_compaction(self) -> float | None:
+        if settings.HISTORY_COMPACT_INTERVAL <= 0:
+            return None
+        return max(0.0, self._next_compaction - time.monotonic())
+
+    def _run(self) -> None:
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self._until_compaction())]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < _BATCH_MAX:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                self._process(batch)
+            if self._until_compaction() == 0.0:
+                self._next_compaction = time.monotonic() + settings.HISTORY_COMPACT_INTERVAL
+                try:
+                    _compact(_conn())
+                except Exception:
+                    logging.exception("Failed to compact chat history database")
+
+    def _process(self, batch) -> None:
+        try:
+            self._write(batch)
+        except Exception:
+            logging.exception(f"Failed to write {len(batch)} chat history entries")
+        with self._cond:
+            for client_id, _ in batch:
+                left = self._pending[client_id] - 1
+                if left:
+                    self._pending[client_id] = left
+                else:
+                    del self._pending[client_id]
+            self._cond.notify_all()
+
+    def _write(self, batch) -> None:
+        started = time.perf_counter()
+        rows = [(client_id, role, content) for client_id, messages in batch for role, content in messages]
+        con = _conn()
+        with con:
+            con.executemany("INSERT INTO messages(client_id, role, content) VALUES(?,?,?)", rows)
+            for client_id in {client_id for client_id, _ in batch}:
+                _apply_retention(con, client_id)
+        # Запис не належить жодному запиту (він фоновий), тож іде лише в гістограму.
+        metrics.stage_seconds.observe(time.perf_counter() - started, "history_write")
+
+_writer: _Writer | None = None
+_writer_lock = threading.Lock()
+
+def _get_writer() -> _Writer:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = _Writer()
+    return _writer
+
+# === Політика зберігання ======================================================
+# Лишаємо для клієнта лише HISTORY_MAX_MESSAGES найновіших повідомлень. Завдяки
+# індексу (client_id, id) і пошук межі, і видалення зачіпають лише рядки
+# цього клієнта. Повідомлення новіші за summaries.upto_id ще не потрапили в
+# підсумок – їх не видаляємо, інакше вони зникли б з розмови безслідно;
+# context.py згорне їх у підсумок на наступному ході, і тоді їх приберемо.
+def _apply_retention(con: sqlite3.Connection, client_id: str) -> None:
+    keep = settings.HISTORY_MAX_MESSAGES
+    if keep <= 0:
+        return
+    con.execute(
+        """DELETE FROM messages WHERE client_id=? AND id < (
+               SELECT id FROM messages WHERE client_id=? ORDER BY id DESC LIMIT 1 OFFSET ?
+           ) AND id <= COALESCE((SELECT upto_id FROM summaries WHERE client_id=?), 0)""",
+        (client_id, client_id, keep - 1, client_id),
+    )
+
+def _compact(con: sqlite3.Connection) -> None:
+    started = time.perf_counter()
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    con.execute("PRAGMA optimize")
+    metrics.stage_seconds.observe(time.perf_counter() - started, "history_compact")
+
+def compact() -> None:
+    """Переносить WAL у основний файл і оновлює статистику планувальника запитів."""
+    flush()
+    _compact(_conn())
+
+# === Публічний інтерфейс ======================================================
+# Додаємо нове повідомлення у базу (асинхронно, через фоновий записувач).
 def add(client_id: str, role: str, content: str) -> None:
-    with sqlite3.connect(_DB) as con:
-        con.execute("INSERT INTO messages(client_id, role, content) VALUES(?,?,?)",
-                    (client_id, role, content))
+    _get_writer().submit(client_id, [(role, content)])
+
+# Додаємо кілька повідомлень одного клієнта, наприклад запит і відповідь
+# одного ходу чату. Вони гарантовано потраплять в одну транзакцію.
+def add_many(client_id: str, messages: Iterable[Tuple[str, str]]) -> None:
+    _get_writer().submit(client_id, list(messages))
+
+# Чекаємо, поки черга записів спорожніє.
+def flush(client_id: str | None = None, timeout: float | None = 10.0) -> bool:
+    if _writer is None:
+        return True
+    return _writer.flush(client_id, timeout)
 
 # Повертаємо останні N повідомлень у вигляді [(role, content), ...]
 def history(client_id: str, limit: int = 20) -> list[Tuple[str,str]]:
-    with sqlite3.connect(_DB) as con:
-        rows = con.execute(
-            "SELECT role, content FROM messages WHERE client_id=? ORDER BY id DESC LIMIT ?",
-            (client_id, limit)
-        ).fetchall()
+    # Спершу дочекаємося записів цього клієнта, що ще стоять у черзі, щоб
+    # наступний хід чату бачив попередній.
+    flush(client_id)
+    rows = _conn().execute(
+        "SELECT role, content FROM messages WHERE client_id=? ORDER BY id DESC LIMIT ?",
+        (client_id, limit)
+    ).fetchall()
     # У SQLite вибірка йде в зворотному порядку, тому перевертаємо список.
     return list(reversed(rows))
+
+# Повідомлення клієнта з id > after_id, від найновішого до найстарішого:
+# [(id, role, content), ...]. Використовується для побудови контексту поверх
+# підсумку, що вже покриває повідомлення до after_id включно.
+def messages_after(client_id: str, after_id: int, limit: int = 200) -> list[Tuple[int, str, str]]:
+    flush(client_id)
+    return _conn().execute(
+        "SELECT id, role, content FROM messages WHERE client_id=? AND id>? ORDER BY id DESC LIMIT ?",
+        (client_id, after_id, limit)
+    ).fetchall()
+
+# Повідомлення клієнта з after_id < id < before_id, від найстарішого:
+# [(id, role, content), ...]. Цим context.py посторінково згортає в підсумок
+# те, що не влізло у вікно messages_after.
+def messages_between(client_id: str, after_id: int, before_id: int, limit: int = 200) -> list[Tuple[int, str, str]]:
+    flush(client_id)
+    return _conn().execute(
+        "SELECT id, role, content FROM messages WHERE client_id=? AND id>? AND id<? ORDER BY id LIMIT ?",
+        (client_id, after_id, before_id, limit)
+    ).fetchall()
+
+# Підсумок розмови та id останнього врахованого в ньому повідомлення.
+def get_summary(client_id: str) -> Tuple[str, int]:
+    row = _conn().execute(
+        "SELECT summary, upto_id FROM summaries WHERE client_id=?", (client_id,)
+    ).fetchone()
+    return (row[0], row[1]) if row else ("", 0)
+
+def save_summary(client_id: str, summary: str, upto_id: int) -> None:
+    con = _conn()
+    with con:
+        con.execute(
+            """INSERT INTO summaries(client_id, summary, upto_id) VALUES(?,?,?)
+               ON CONFLICT(client_id) DO UPDATE SET
+                   summary=excluded.summary, upto_id=excluded.upto_id, ts=CURRENT_TIMESTAMP""",
+            (client_id, summary, upto_id)
+        )
+
+# При завершенні процесу дописуємо все, що ще лежить у черзі.
+atexit.register(flush)
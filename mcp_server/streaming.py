@@ -0,0 +1,191 @@
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from . import metrics
+
+# ---------------------------------------------------------------------------
+#  Міст між подіями CrewAI та HTTP-стрімом. Під час виконання агента CrewAI
+#  публікує події у глобальну шину crewai_event_bus: шматки тексту від LLM
+#  (коли LLM створено зі stream=True), старт і завершення викликів
+#  інструментів тощо. Ми підписуємося на них один раз, за agent_id знаходимо,
+#  якому HTTP-запиту належить подія, і кладемо її в asyncio-чергу цього
+#  запиту. Обробник /chat/stream читає чергу та одразу віддає події клієнту
+#  у форматі Server-Sent Events (SSE).
+#
+#  Сам CrewAI імпортується лише в install() та bind(): main.py користується
+#  RunEvents і format_sse ще до того, як важкий crew_runtime завантажено.
+#
+#  Ті самі події живлять метрики (metrics.py): тривалість викликів LLM та
+#  інструментів, кількість токенів. Якщо запуск має трасу запиту, час
+#  потрапляє і в неї – для Server-Timing та підсумкової події стріму.
+# ---------------------------------------------------------------------------
+
+class RunEvents:
+    """Черга подій одного запуску агента. emit() можна викликати з будь-якого потоку."""
+
+    _CLOSED = object()
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, trace: metrics.RequestTrace | None = None):
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.trace = trace
+        # Що, крім бази знань, вплинуло на відповідь: інструменти, які викликав
+        # агент (tools), серед них – інструменти MCP цього запуску (mcp_tools
+        # заповнює crew_runtime), та історія розмови. Відповіді, що спиралися на
+        # MCP або історію, не потрапляють у кеш відповідей.
+        self.tools: set[str] = set()
+        self.mcp_tools: set[str] = set()
+        self.used_history = False
+        self.cached = False  # відповідь узято з кешу відповідей, агент не запускався
+
+    def emit(self, event: str, data: dict[str, Any]) -> None:
+        # CrewAI працює в робочому потоці, а черга належить циклу подій
+        # сервера, тому передаємо елемент через call_soon_threadsafe.
+        if data.get("tool"):
+            self.tools.add(str(data["tool"]))
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (event, data))
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, self._CLOSED)
+
+    async def __aiter__(self):
+        while True:
+            item = await self._queue.get()
+            if item is self._CLOSED:
+                return
+            yield item
+
+# === Реєстр активних запусків ==================================================
+# Ключ – agent.id (його CrewAI додає до кожної події агента) або id(llm):
+# кожен запуск створює власні Agent та LLM, тож ключі не перетинаються.
+_runs: dict[Any, RunEvents] = {}
+_runs_lock = threading.Lock()
+
+@contextmanager
+def bind(events: RunEvents, agent: Any, llm: Any) -> Iterator[None]:
+    """Направляє події цього агента та LLM у events на час блоку with."""
+    keys = (str(agent.id), id(llm))
+    with _runs_lock:
+        for key in keys:
+            _runs[key] = events
+    try:
+        yield
+    finally:
+        # Обробники шини можуть виконуватися у фоновому пулі потоків, тож
+        # чекаємо, поки вони доставлять усі події, і лише потім відписуємося.
+        from crewai.events import crewai_event_bus
+
+        flush = getattr(crewai_event_bus, "flush", None)
+        if flush is not None:
+            flush(timeout=5.0)
+        with _runs_lock:
+            for key in keys:
+                _runs.pop(key, None)
+
+def _lookup(source: Any, event: Any) -> RunEvents | None:
+    with _runs_lock:
+        return _runs.get(getattr(event, "agent_id", None)) or _runs.get(id(source))
+
+# === Обробники подій CrewAI ====================================================
+def _on_llm_chunk(source, event):
+    run = _lookup(source, event)
+    if run is not None and event.chunk:
+        run.emit("token", {"text": event.chunk})
+
+# Виклики LLM: час між стартом і завершенням рахуємо за мітками часу подій
+# (а не за часом обробки – обробники виконуються у фоновому пулі із затримкою).
+_llm_started: dict[str, Any] = {}
+_llm_lock = threading.Lock()
+
+def _on_llm_started(source, event):
+    if event.call_id:
+        with _llm_lock:
+            _llm_started[event.call_id] = event.timestamp
+
+def _llm_finished(source, event) -> None:
+    with _llm_lock:
+        started = _llm_started.pop(event.call_id, None)
+    if started is not None:
+        run = _lookup(source, event)
+        duration = (event.timestamp - started).total_seconds()
+        metrics.observe("llm_call", duration, run.trace if run is not None else None)
+
+def _on_llm_completed(source, event):
+    _llm_finished(source, event)
+    usage = event.usage or {}
+    metrics.llm_tokens.inc("in", amount=usage.get("prompt_tokens") or 0)
+    metrics.llm_tokens.inc("out", amount=usage.get("completion_tokens") or 0)
+
+def _on_llm_failed(source, event):
+    _llm_finished(source, event)
+    metrics.stage_errors.inc("llm_call")
+
+def _on_tool_started(source, event):
+    run = _lookup(source, event)
+    if run is not None:
+        run.emit("tool_call", {"tool": event.tool_name, "args": event.tool_args})
+
+def _on_tool_finished(source, event):
+    run = _lookup(source, event)
+    duration = (event.finished_at - event.started_at).total_seconds()
+    metrics.tool_calls.inc(event.tool_name, "ok")
+    metrics.observe("tool_call", duration, run.trace if run is not None else None)
+    if run is not None:
+        run.emit("tool_result", {
+            "tool": event.tool_name,
+            "from_cache": event.from_cache,
+            "duration_ms": round(duration * 1000, 1),
+        })
+
+def _on_tool_error(source, event):
+    metrics.tool_calls.inc(event.tool_name, "error")
+    run = _lookup(source, event)
+    if run is not None:
+        run.emit("tool_error", {"tool": event.tool_name, "error": str(event.error)})
+
+_installed = False
+
+# Підписує обробники на шину CrewAI. Викликається з crew_runtime під час
+# його імпорту; повторні виклики нічого не роблять.
+def install() -> None:
+    global _installed
+    if _installed:
+        return
+    from crewai.events import (
+        crewai_event_bus,
+        LLMStreamChunkEvent,
+        LLMCallStartedEvent,
+        LLMCallCompletedEvent,
+        LLMCallFailedEvent,
+        ToolUsageStartedEvent,
+        ToolUsageFinishedEvent,
+        ToolUsageErrorEvent,
+    )
+
+    crewai_event_bus.on(LLMStreamChunkEvent)(_on_llm_chunk)
+    crewai_event_bus.on(LLMCallStartedEvent)(_on_llm_started)
+    crewai_event_bus.on(LLMCallCompletedEvent)(_on_llm_completed)
+    crewai_event_bus.on(LLMCallFailedEvent)(_on_llm_failed)
+    crewai_event_bus.on(ToolUsageStartedEvent)(_on_tool_started)
+    crewai_event_bus.on(ToolUsageFinishedEvent)(_on_tool_finished)
+    crewai_event_bus.on(ToolUsageErrorEvent)(_on_tool_error)
+    _installed = True
+
+# step_callback агента: викликається після кожного кроку міркування
+# (AgentAction – рішення викликати інструмент, AgentFinish – фінальна відповідь).
+def step_event(formatted_answer: Any) -> dict[str, Any]:
+    data = {"kind": type(formatted_answer).__name__}
+    for attr in ("thought", "tool", "tool_input"):
+        value = getattr(formatted_answer, attr, None)
+        if value:
+            data[attr] = value
+    return data
+
+# === Формат Server-Sent Events =================================================
+# Кожна подія – це рядки "event: <тип>" та "data: <json>", розділені порожнім
+# рядком. JSON дозволяє безпечно передавати текст із переносами рядків.
+def format_sse(event: str, data: dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"